@@ -3,13 +3,13 @@ import io
 import numpy as np
 from PIL import Image, ImageFilter
 
-from plate_recognition import parse_arguments, recognition_api
+from plate_recognition import iter_files, parse_arguments, recognition_api
 
 
 def main():
     args = parse_arguments()
     scores = []
-    for path in args.files:
+    for path in iter_files(args):
         blur_amount = 0
         init_value = ""
         while True:
@@ -0,0 +1,69 @@
+import argparse
+import statistics
+import subprocess
+import sys
+from timeit import default_timer
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Measure the cold start time of a Python module."
+    )
+    parser.add_argument(
+        "modules",
+        nargs="*",
+        default=["plate_recognition"],
+        help="Modules to import, each in a new interpreter.",
+    )
+    parser.add_argument("--iterations", default=20, type=int)
+    parser.add_argument(
+        "--python", default=sys.executable, help="Interpreter to benchmark."
+    )
+    return parser.parse_args()
+
+
+def cold_start(python, statement, iterations):
+    durations = []
+    for _ in range(iterations):
+        start = default_timer()
+        subprocess.run([python, "-c", statement], check=True)
+        durations.append((default_timer() - start) * 1000)
+    return durations
+
+
+def loaded_modules(python, module):
+    heavy = ["PIL.Image", "requests", "numpy", "csv", "asyncio", "http.server"]
+    output = subprocess.run(
+        [
+            python,
+            "-c",
+            f"import sys, {module}; print(' '.join(m for m in {heavy!r} if m in sys.modules))",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return output.strip() or "-"
+
+
+def main():
+    args = parse_arguments()
+    interpreter = cold_start(args.python, "pass", args.iterations)
+    baseline = statistics.median(interpreter)
+    print("| Module                    | Median | Min    | Import | Loaded")
+    print("| ------------------------- | ------ | ------ | ------ | ------")
+    print(
+        f"| {'(interpreter)':25s} | {baseline:6.1f} | {min(interpreter):6.1f} "
+        f"| {0:6.1f} | -"
+    )
+    for module in args.modules:
+        durations = cold_start(args.python, f"import {module}", args.iterations)
+        median = statistics.median(durations)
+        print(
+            f"| {module:25s} | {median:6.1f} | {min(durations):6.1f} "
+            f"| {median - baseline:6.1f} | {loaded_modules(args.python, module)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import argparse
+import json
+import tracemalloc
+from timeit import default_timer
+
+from benchmark.mock_sdk import sample_response
+from plate_recognition import JSON_DECODERS
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Compare the decoders of the API responses."
+    )
+    parser.add_argument(
+        "--response", help="JSON response to decode, a generated one by default."
+    )
+    parser.add_argument("--plates", default=10, type=int)
+    parser.add_argument("--iterations", default=2000, type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.response:
+        with open(args.response, "rb") as fp:
+            response = fp.read()
+    else:
+        response = sample_response(args.plates)
+    expected = json.dumps(JSON_DECODERS["ordered"](response))
+
+    print(f"Response size: {len(response)} bytes")
+    print("| Decoder  | Time us | Peak KB | Same output |")
+    print("| -------- | ------- | ------- | ----------- |")
+    for name, loads in sorted(JSON_DECODERS.items()):
+        try:
+            result = loads(response)
+        except ImportError:
+            print(f"| {name:8s} | not installed")
+            continue
+        now = default_timer()
+        for _ in range(args.iterations):
+            loads(response)
+        duration = (default_timer() - now) / args.iterations * 1e6
+        tracemalloc.start()
+        loads(response)
+        peak = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+        same = json.dumps(result) == expected
+        print(f"| {name:8s} | {duration:7.1f} | {peak:7.1f} | {str(same):11s} |")
+
+
+if __name__ == "__main__":
+    main()
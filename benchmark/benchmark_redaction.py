@@ -0,0 +1,57 @@
+import argparse
+import random
+from timeit import default_timer
+
+from PIL import Image
+
+from number_plate_redaction import BLUR_ENGINES
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Compare the blur engines of number_plate_redaction.py."
+    )
+    parser.add_argument("--width", default=4000, type=int)
+    parser.add_argument("--height", default=3000, type=int)
+    parser.add_argument("--plates", default=40, type=int)
+    parser.add_argument(
+        "--dense", action="store_true", help="Plates are close to each other."
+    )
+    parser.add_argument("--iterations", default=10, type=int)
+    return parser.parse_args()
+
+
+def generate_results(args):
+    rand = random.Random(1)
+    results = []
+    for i in range(args.plates):
+        width = rand.randint(80, 600)
+        if args.dense:
+            x, y = 100 + i % 10 * 300, 100 + i // 10 * 150
+        else:
+            x = rand.randint(0, args.width - width)
+            y = rand.randint(0, args.height - width // 3)
+        box = dict(xmin=x, ymin=y, xmax=x + width, ymax=y + width // 3)
+        results.append(dict(plate=f"abc{i:03d}", box=box, vehicle=dict(score=0.8)))
+    return dict(results=results)
+
+
+def main():
+    args = parse_arguments()
+    image = Image.effect_noise((args.width, args.height), 60).convert("RGB")
+    api_res = generate_results(args)
+    print("| Engine | Mode     | Time ms |")
+    print("| ------ | -------- | ------- |")
+    for mode in ["gaussian", "pixelate"]:
+        for name, blur in sorted(BLUR_ENGINES.items()):
+            durations = []
+            for _ in range(args.iterations):
+                im = image.copy()
+                now = default_timer()
+                blur(im, 5, api_res, mode=mode)
+                durations.append(default_timer() - now)
+            print(f"| {name:6s} | {mode:8s} | {min(durations) * 1000:7.1f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,15 +9,16 @@ import requests
 from PIL import Image
 from psutil import cpu_percent, process_iter
 
-from plate_recognition import recognition_api
+from plate_recognition import get_client, recognition_api
 
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Benchmark SDK.")
     parser.add_argument(
         "--sdk-url",
-        help="Url to self hosted sdk  For example, http://localhost:8080",
-        default="http://localhost:8080",
+        help="Url to self hosted sdk  For example, http://localhost:8080. "
+        "Repeat to spread the calls over several SDK instances.",
+        action="append",
     )
     parser.add_argument(
         "--threads", help="Use thread to parallelize API calls", default=4, type=int
@@ -26,7 +27,9 @@ def parse_arguments():
     parser.add_argument("--mmc", action="store_true")
     parser.add_argument("--iterations", default=50, type=int)
     parser.add_argument("--blur", action="store_true")
-    return parser.parse_args()
+    args = parser.parse_args()
+    args.sdk_url = args.sdk_url or ["http://localhost:8080"]
+    return args
 
 
 def print_table(results):
@@ -67,7 +70,14 @@ def call_duration(path, sdk_url, config, mmc, blur):
     now = default_timer()
     with open(path, "rb") as fp:
         if blur:
-            blur_api(sdk_url, fp)
+            pool = get_client().get_pool(sdk_url)
+            endpoint = pool.acquire()
+            ok = False
+            try:
+                blur_api(endpoint.url, fp)
+                ok = True
+            finally:
+                pool.release(endpoint, ok, default_timer() - now)
         else:
             recognition_api(
                 fp,
@@ -166,6 +176,8 @@ def main():
             f"SHR {convert_size(mem.shared):10} ({convert_size(mem.shared - initial_mem[pid].shared):10})"
         )
     print_table(results)
+    if len(args.sdk_url) > 1:
+        print(get_client().get_pool(args.sdk_url).summary())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,256 @@
+"""
+Client-side benchmarks that run against the local mock SDK.
+
+    python -m pytest benchmark/client_benchmark.py -q
+
+Each benchmark reports the throughput, the peak RSS of the process and the
+p50/p95/p99 latency of one operation. No SDK and no network access are needed.
+The FTP benchmark requires pyftpdlib.
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from timeit import default_timer
+
+import psutil
+import pytest
+from PIL import Image
+
+from benchmark.mock_sdk import MockSDK, sample_response
+from plate_recognition import (
+    JSON_DECODERS,
+    RateLimiter,
+    RecognitionClient,
+    process_split_image,
+    recognition_api,
+    save_results,
+    set_client,
+)
+
+REPORT = []
+
+
+class PeakRSS:
+    """Sample the resident memory of the process in a background thread."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self._process.memory_info().rss
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._process.memory_info().rss)
+
+
+def run(name, func, items, workers=1):
+    """Call func on every item, record the timings and return the results."""
+    durations = []
+
+    def timed_call(item):
+        start = default_timer()
+        result = func(item)
+        durations.append(default_timer() - start)
+        return result
+
+    with PeakRSS() as rss:
+        start = default_timer()
+        if workers > 1:
+            with ThreadPoolExecutor(workers) as executor:
+                results = list(executor.map(timed_call, items))
+        else:
+            results = [timed_call(item) for item in items]
+        elapsed = default_timer() - start
+    percentiles = statistics.quantiles(durations, n=100) if len(durations) > 1 else []
+    REPORT.append(
+        dict(
+            name=name,
+            count=len(durations),
+            throughput=len(durations) / elapsed,
+            rss=rss.peak / 1024**2,
+            p50=percentiles[49] * 1000 if percentiles else durations[0] * 1000,
+            p95=percentiles[94] * 1000 if percentiles else durations[0] * 1000,
+            p99=percentiles[98] * 1000 if percentiles else durations[0] * 1000,
+        )
+    )
+    return results
+
+
+@pytest.fixture(scope="module", autouse=True)
+def report(request):
+    yield
+    capture = request.config.pluginmanager.get_plugin("capturemanager")
+    lines = [
+        "",
+        "| Benchmark                      | Count  | Per sec  | Peak RSS MB | p50 ms  | p95 ms  | p99 ms  |",
+        "| ------------------------------ | ------ | -------- | ----------- | ------- | ------- | ------- |",
+    ]
+    for row in REPORT:
+        lines.append(
+            "| {name:30s} | {count:6d} | {throughput:8.1f} | {rss:11.1f} "
+            "| {p50:7.1f} | {p95:7.1f} | {p99:7.1f} |".format(**row)
+        )
+    with capture.global_and_fixture_disabled():
+        print("\n".join(lines))
+
+
+@pytest.fixture(scope="module")
+def sdk():
+    with MockSDK(latency=0.02, jitter=0.3, seed=1) as sdk:
+        yield sdk
+
+
+@pytest.fixture(scope="module")
+def image_bytes():
+    buffer = io.BytesIO()
+    Image.effect_noise((1280, 720), 40).convert("RGB").save(buffer, "jpeg")
+    return buffer.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def client():
+    client = RecognitionClient(pool_size=16)
+    set_client(client)
+    yield client
+    client.close()
+    set_client(None)
+
+
+@pytest.mark.parametrize("workers", [1, 8])
+def test_recognition_api(sdk, image_bytes, workers):
+    def recognize(_):
+        return recognition_api(io.BytesIO(image_bytes), sdk_url=sdk.url)
+
+    results = run(f"recognition_api workers={workers}", recognize, range(200), workers)
+    assert all(result["results"] for result in results)
+
+
+def test_recognition_api_throttled(image_bytes):
+    with MockSDK(latency=0.02, throttle_rate=0.2, retry_after=0, seed=2) as sdk:
+        # 3 tries are not enough at a 20% throttle rate over 200 calls, 10 tries
+        # leave a 0.2 ** 10 chance per call of giving up
+        client = RecognitionClient(
+            pool_size=8, rate_limiter=RateLimiter(200), retries=10
+        )
+        set_client(client)
+
+        def recognize(_):
+            return recognition_api(io.BytesIO(image_bytes), sdk_url=sdk.url)
+
+        results = run("recognition_api 20% 429", recognize, range(200), 8)
+    assert all(result["results"] for result in results)
+    assert sdk.throttled > 0
+
+
+def test_process_split_image(sdk, tmp_path):
+    path = tmp_path / "large.jpg"
+    Image.effect_noise((3840, 2160), 40).convert("RGB").save(path)
+    args = argparse.Namespace(
+        split_x=3,
+        split_y=2,
+        split_overlap=10,
+        regions=None,
+        api_key=None,
+        sdk_url=sdk.url,
+        camera_id=None,
+        mmc=False,
+        show_boxes=False,
+        annotate_images=False,
+        crop_lp=None,
+        crop_vehicle=None,
+        tile_workers=4,
+        max_upload_dimension=None,
+        upload_quality=None,
+    )
+    results = run(
+        "process_split_image 4K",
+        lambda _: process_split_image(path, args, {}),
+        range(10),
+    )
+    assert all(result["results"] for result in results)
+
+
+@pytest.mark.parametrize("output_format", ["json", "jsonl", "csv"])
+def test_save_results(tmp_path, output_format):
+    result = JSON_DECODERS["dict"](sample_response(3))
+    results = [dict(result, filename=f"{i}.jpg") for i in range(2000)]
+
+    def save(i):
+        args = argparse.Namespace(
+            output_file=tmp_path / f"{i}.{output_format}", format=output_format
+        )
+        save_results(results, args)
+
+    run(f"save_results {output_format} x2000", save, range(5))
+    assert (tmp_path / f"0.{output_format}").stat().st_size > 0
+
+
+def test_ftp_processor(sdk, tmp_path, image_bytes, monkeypatch):
+    pytest.importorskip("pyftpdlib")
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+
+    import ftp_and_sftp_processor
+
+    camera = tmp_path / "ftp" / "camera-1"
+    camera.mkdir(parents=True)
+    for i in range(50):
+        (camera / f"{i:03d}.jpg").write_bytes(image_bytes)
+    authorizer = DummyAuthorizer()
+    authorizer.add_user("user", "secret", str(tmp_path / "ftp"), perm="elr")
+    handler = type("Handler", (FTPHandler,), dict(authorizer=authorizer))
+    server = ThreadedFTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    output = tmp_path / "results.jsonl"
+    argv = [
+        "ftp_and_sftp_processor.py",
+        "--api-key",
+        "KEY",
+        "--sdk-url",
+        sdk.url,
+        "--hostname",
+        "127.0.0.1",
+        "--port",
+        str(server.address[1]),
+        "--ftp-user",
+        "user",
+        "--ftp-password",
+        "secret",
+        "--folder",
+        "/camera-1",
+        "--output-file",
+        str(output),
+        "--format",
+        "jsonl",
+    ]
+    monkeypatch.setattr(sys, "argv", argv)
+    args = ftp_and_sftp_processor.parse_arguments(ftp_and_sftp_processor.custom_args)
+    try:
+        run("ftp processor 50 files", ftp_and_sftp_processor.ftp_process, [args])
+    finally:
+        server.close_all()
+    assert len(output.read_text().splitlines()) == 50
+    REPORT[-1]["throughput"] *= 50  # Files per second
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([os.fspath(Path(__file__)), "-q"]))
@@ -0,0 +1,259 @@
+"""
+Local stand-in for the Snapshot SDK and the Blur SDK.
+
+It answers /v1/plate-reader/ with a canned response and any other POST with a
+blur response containing the uploaded image. Latency follows a log-normal
+distribution with optional slow outliers and some calls can be answered with
+429 to exercise the retries of the clients.
+
+    python -m benchmark.mock_sdk --port 8080 --latency 50 --jitter 0.3 --throttle-rate 0.05
+"""
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def sample_response(plates=1):
+    """Response of a call with mmc=true and all the candidates."""
+
+    def box(i):
+        return dict(xmin=10 * i, ymin=20 * i, xmax=10 * i + 90, ymax=20 * i + 30)
+
+    results = []
+    for i in range(plates):
+        results.append(
+            dict(
+                box=box(i),
+                plate=f"abc{i:03d}",
+                region=dict(code="us-ca", score=0.87),
+                score=0.901,
+                candidates=[
+                    dict(score=0.9 - j / 10, plate=f"abc{j:03d}") for j in range(6)
+                ],
+                dscore=0.712,
+                vehicle=dict(score=0.824, type="Sedan", box=box(i + 1)),
+                model_make=[
+                    dict(make="Toyota", model="Camry", score=0.61),
+                    dict(make="Honda", model="Accord", score=0.2),
+                ],
+                color=[dict(color="silver", score=0.7), dict(color="white", score=0.2)],
+                orientation=[dict(orientation="Front", score=0.91)],
+                direction=90,
+                direction_score=0.81,
+            )
+        )
+    return json.dumps(
+        dict(
+            processing_time=120.54,
+            results=results,
+            filename="1617_abc.jpg",
+            version=1,
+            camera_id="camera-1",
+            timestamp="2024-01-01T16:17:10.386Z",
+        )
+    ).encode()
+
+
+def form_files(content_type, body):
+    """Return the uploaded files of a multipart/form-data body by field name."""
+    message = BytesParser().parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+    )
+    files = {}
+    for part in message.get_payload() if message.is_multipart() else []:
+        if part.get_filename() is not None:
+            name = part.get_param("name", header="content-disposition")
+            files[name] = part.get_payload(decode=True)
+    return files
+
+
+class MockSDK:
+    """
+    Threaded HTTP server imitating the SDK.
+
+    :param latency: median response time in seconds
+    :param jitter: sigma of the log-normal distribution of the response time
+    :param slow_rate: fraction of the calls taking slow_latency seconds
+    :param throttle_rate: fraction of the calls answered with 429
+    :param retry_after: Retry-After header of the 429 responses, in seconds
+    :param response: body of the plate-reader responses, sample_response(plates) by default
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=0.05,
+        jitter=0.0,
+        slow_rate=0.0,
+        slow_latency=1.0,
+        throttle_rate=0.0,
+        retry_after=1,
+        response=None,
+        plates=1,
+        seed=None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.response = response or sample_response(plates)
+        self.requests = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _draw(self):
+        """Return (throttled, delay) for the next call."""
+        with self._lock:
+            self.requests += 1
+            if self._random.random() < self.throttle_rate:
+                self.throttled += 1
+                return True, 0.0
+            if self._random.random() < self.slow_rate:
+                return False, self.slow_latency
+            if self.jitter:
+                return False, self.latency * self._random.lognormvariate(0, self.jitter)
+            return False, self.latency
+
+    def _handler(self):
+        sdk = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self.send_body(200, b'{"status": "ok"}')
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                throttled, delay = sdk._draw()
+                if throttled:
+                    self.send_body(
+                        429,
+                        b'{"detail": "Request was throttled."}',
+                        {"Retry-After": str(sdk.retry_after)},
+                    )
+                    return
+                time.sleep(delay)
+                if self.path.startswith("/v1/plate-reader"):
+                    self.send_body(200, sdk.response)
+                    return
+                files = form_files(self.headers.get("Content-Type", ""), body)
+                if "upload" not in files:
+                    self.send_body(400, b'{"error": "Missing upload."}')
+                    return
+                blur = dict(base64=base64.b64encode(files["upload"]).decode())
+                self.send_body(200, json.dumps(dict(blur=blur)).encode())
+
+            def send_body(self, status, body, headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Mock Snapshot and Blur SDK.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", default=8080, type=int)
+    parser.add_argument(
+        "--latency", default=50, type=float, help="Median response time in ms."
+    )
+    parser.add_argument(
+        "--jitter",
+        default=0.0,
+        type=float,
+        help="Sigma of the log-normal distribution of the response time, for example 0.3.",
+    )
+    parser.add_argument(
+        "--slow-rate", default=0.0, type=float, help="Fraction of slow calls."
+    )
+    parser.add_argument(
+        "--slow-latency", default=1000, type=float, help="Slow response time in ms."
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        default=0.0,
+        type=float,
+        help="Fraction of the calls answered with 429.",
+    )
+    parser.add_argument("--retry-after", default=1, type=int)
+    parser.add_argument(
+        "--response", help="File with the JSON body of the plate-reader responses."
+    )
+    parser.add_argument(
+        "--plates",
+        default=1,
+        type=int,
+        help="Number of plates in the generated response.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    response = None
+    if args.response:
+        with open(args.response, "rb") as fp:
+            response = fp.read()
+    sdk = MockSDK(
+        args.host,
+        args.port,
+        latency=args.latency / 1000,
+        jitter=args.jitter,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency / 1000,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        response=response,
+        plates=args.plates,
+    )
+    print(f"Mock SDK listening on {sdk.url}")
+    try:
+        sdk.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,15 @@ import imghdr
 import logging
 import os
 import sys
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
 
 LOG_LEVEL = os.environ.get("LOGGING", "INFO").upper()
 
@@ -76,9 +81,12 @@ def get_output_path(output_dir, path, rename_file):
     return output
 
 
-def process(args, path: Path, output: Path, logo=None):
+def process(args, path: Path, output: Path, logo=None, session=None):
     """
     Process An Image
+
+    The output is written to a temporary file first, so --resume never skips
+    a partially written image.
     """
     lgr.debug(f"output path: {output}")
     with open(path, "rb") as fp:
@@ -109,7 +117,7 @@ def process(args, path: Path, output: Path, logo=None):
         else:
             headers = None
 
-        response = requests.post(
+        response = (session or requests).post(
             args.blur_url,
             headers=headers,
             files={"logo": logo, "upload": fp},
@@ -134,21 +142,18 @@ def process(args, path: Path, output: Path, logo=None):
         else:
             base64_encoded_data = blur_data["base64"]
             decoded_bytes = base64.b64decode(base64_encoded_data)
-            with open(output, "wb") as f:
+            partial = output.with_name(f"{output.name}.part")
+            with open(partial, "wb") as f:
                 f.write(decoded_bytes)
+            os.replace(partial, output)
 
 
-def process_dir(input_dir: Path, args, output_dir: Path, rename_file, resume):
+def iter_images(input_dir: Path, output_dir: Path, rename_file, resume):
     """
-    Recursively Process Images in a directory
+    Recursively find the images left to blur in a directory
 
-    :return:
+    :return: (image path, output path) iterator
     """
-    logo_bytes = None
-    if args.logo:
-        with open(args.logo, "rb") as fp:
-            logo_bytes = fp.read()
-
     for path in input_dir.glob("**/*"):
         if path.is_file() and not path.name.startswith("blur-"):
             lgr.info(f"Processing file: {path}")
@@ -160,7 +165,62 @@ def process_dir(input_dir: Path, args, output_dir: Path, rename_file, resume):
             output_path = get_output_path(output_dir, path, rename_file)
             if resume and output_path.is_file():
                 continue
-            process(args, path, output_path, logo_bytes)
+            yield path, output_path
+
+
+def process_dir(input_dir: Path, args, output_dir: Path, rename_file, resume):
+    """
+    Recursively Process Images in a directory
+
+    Up to args.workers images are sent to the Blur SDK concurrently and at most
+    2 * args.workers are queued. Progress is reported in directory order.
+
+    :return:
+    """
+    logo_bytes = None
+    if args.logo:
+        with open(args.logo, "rb") as fp:
+            logo_bytes = fp.read()
+
+    workers = max(args.workers, 1)
+    # Sessions are not thread-safe, each thread has one sharing the connections
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    local = threading.local()
+
+    def blur(path, output_path):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            local.session = session
+        process(args, path, output_path, logo_bytes, session)
+
+    start = time.time()
+    done = 0
+
+    def report(path, future):
+        nonlocal done
+        future.result()
+        done += 1
+        rate = done / max(time.time() - start, 1e-6)
+        lgr.info(f"Blurred {done} images ({rate:.1f}/s): {path}")
+
+    with closing(adapter), ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for path, output_path in iter_images(
+                input_dir, output_dir, rename_file, resume
+            ):
+                future = executor.submit(blur, path, output_path)
+                pending.append((path, future))
+                if len(pending) >= 2 * workers:
+                    report(*pending.popleft())
+            while pending:
+                report(*pending.popleft())
+        finally:
+            for _, future in pending:
+                future.cancel()
 
 
 def main():
@@ -245,6 +305,12 @@ Specify engine config and/or two regions:
         help="Skip already blurred images.",
         default=False,
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of images sent to the Blur SDK concurrently.",
+    )
     parser.add_argument(
         "--copy-metadata",
         action="store_true",
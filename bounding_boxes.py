@@ -0,0 +1,150 @@
+"""
+Filtering of overlapping detections, shared by plate_recognition.py and
+number_plate_redaction.py.
+
+NumPy is used when it is installed. Otherwise the pure Python versions give
+the same results.
+"""
+from itertools import combinations
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def bb_iou(a, b):
+    # determine the (x, y)-coordinates of the intersection rectangle
+    x_a = max(a["xmin"], b["xmin"])
+    y_a = max(a["ymin"], b["ymin"])
+    x_b = min(a["xmax"], b["xmax"])
+    y_b = min(a["ymax"], b["ymax"])
+
+    # compute the area of both the prediction and ground-truth
+    # rectangles
+    area_a = (a["xmax"] - a["xmin"]) * (a["ymax"] - a["ymin"])
+    area_b = (b["xmax"] - b["xmin"]) * (b["ymax"] - b["ymin"])
+
+    # compute the area of intersection rectangle
+    area_inter = max(0, x_b - x_a) * max(0, y_b - y_a)
+    return area_inter / float(max(area_a + area_b - area_inter, 1))
+
+
+def inside(a, b):
+    return (
+        a["xmin"] > b["xmin"]
+        and a["ymin"] > b["ymin"]
+        and a["xmax"] < b["xmax"]
+        and a["ymax"] < b["ymax"]
+    )
+
+
+def box_array(boxes):
+    """Return an (n, 4) array of xmin, ymin, xmax, ymax."""
+    return np.array(
+        [[b["xmin"], b["ymin"], b["xmax"], b["ymax"]] for b in boxes], dtype=float
+    ).reshape(-1, 4)
+
+
+def iou_matrix(boxes):
+    """Pairwise bb_iou of an (n, 4) array of boxes."""
+    x_a = np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+    y_a = np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    x_b = np.minimum(boxes[:, None, 2], boxes[None, :, 2])
+    y_b = np.minimum(boxes[:, None, 3], boxes[None, :, 3])
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    area_inter = np.maximum(0, x_b - x_a) * np.maximum(0, y_b - y_a)
+    return area_inter / np.maximum(area[:, None] + area[None, :] - area_inter, 1)
+
+
+def inside_matrix(boxes):
+    """Element [i, j] is True when box i is strictly inside box j."""
+    return (
+        (boxes[:, None, 0] > boxes[None, :, 0])
+        & (boxes[:, None, 1] > boxes[None, :, 1])
+        & (boxes[:, None, 2] < boxes[None, :, 2])
+        & (boxes[:, None, 3] < boxes[None, :, 3])
+    )
+
+
+def _clean_objs(objects, threshold=0.1):
+    # Only keep the ones with best score or no overlap
+    for o1, o2 in combinations(objects, 2):
+        if (
+            "remove" in o1
+            or "remove" in o2
+            or bb_iou(o1["box"], o2["box"]) <= threshold
+        ):
+            continue
+        if o1["score"] > o2["score"]:
+            o2["remove"] = True
+        else:
+            o1["remove"] = True
+    return [x for x in objects if "remove" not in x]
+
+
+def clean_objs(objects, threshold=0.1):
+    """
+    Remove overlapping objects, keeping the one with the best score.
+
+    Pairs are visited in the same order as _clean_objs: an object removes the
+    following overlapping objects until one of them has a better score.
+    """
+    if np is None or len(objects) < 2:
+        return _clean_objs(objects, threshold)
+    boxes = box_array([o["box"] for o in objects])
+    overlap = np.triu(iou_matrix(boxes) > threshold, k=1)
+    scores = np.array([o["score"] for o in objects])
+    removed = np.zeros(len(objects), dtype=bool)
+    for i in np.flatnonzero(overlap.any(axis=1)):
+        if removed[i]:
+            continue
+        others = np.flatnonzero(overlap[i] & ~removed)
+        if not len(others):
+            continue
+        losses = np.flatnonzero(scores[i] <= scores[others])
+        if len(losses):
+            removed[others[: losses[0]]] = True
+            removed[i] = True
+        else:
+            removed[others] = True
+    return [objects[i] for i in np.flatnonzero(~removed)]
+
+
+def merge_results(images):
+    result = dict(results=[])
+    for data in images:
+        for item in data["prediction"]["results"]:
+            result["results"].append(item)
+            for b in [item["box"], item["vehicle"].get("box", {})]:
+                b["ymin"] += data["y"]
+                b["xmin"] += data["x"]
+                b["ymax"] += data["y"]
+                b["xmax"] += data["x"]
+    result["results"] = clean_objs(result["results"])
+    return result
+
+
+def _post_processing(results):
+    new_list = []
+    for item in results["results"]:
+        if item["score"] < 0.2 and any(
+            [inside(x["box"], item["box"]) for x in results["results"] if x != item]
+        ):
+            continue
+        new_list.append(item)
+    results["results"] = new_list
+    return results
+
+
+def post_processing(results):
+    """Remove low score objects that contain another object."""
+    items = results["results"]
+    if np is None or len(items) < 2:
+        return _post_processing(results)
+    contained = inside_matrix(box_array([x["box"] for x in items]))
+    np.fill_diagonal(contained, False)
+    scores = np.array([x["score"] for x in items])
+    removed = (scores < 0.2) & contained.any(axis=0)
+    results["results"] = [items[i] for i in np.flatnonzero(~removed)]
+    return results
@@ -0,0 +1,51 @@
+import copy
+import random
+
+import pytest
+
+import bounding_boxes
+from bounding_boxes import _clean_objs, _post_processing, clean_objs, post_processing
+
+
+def random_objects(count, seed):
+    rng = random.Random(seed)
+    objects = []
+    for _ in range(count):
+        xmin, ymin = rng.randint(0, 300), rng.randint(0, 300)
+        box = dict(
+            xmin=xmin,
+            ymin=ymin,
+            xmax=xmin + rng.randint(1, 120),
+            ymax=ymin + rng.randint(1, 60),
+        )
+        objects.append(dict(box=box, score=round(rng.random(), 1)))
+    return objects
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("threshold", [0.0, 0.1, 0.5])
+def test_clean_objs_matches_pairwise_version(seed, threshold):
+    objects = random_objects(60, seed)
+    expected = _clean_objs(copy.deepcopy(objects), threshold)
+    result = clean_objs(objects, threshold)
+    assert [o["box"] for o in result] == [o["box"] for o in expected]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_post_processing_matches_pairwise_version(seed):
+    objects = random_objects(60, seed)
+    expected = _post_processing(dict(results=copy.deepcopy(objects)))
+    assert post_processing(dict(results=objects)) == expected
+
+
+def test_post_processing_removes_low_score_container():
+    inner = dict(box=dict(xmin=10, ymin=10, xmax=20, ymax=20), score=0.9)
+    outer = dict(box=dict(xmin=0, ymin=0, xmax=30, ymax=30), score=0.1)
+    assert post_processing(dict(results=[outer, inner])) == dict(results=[inner])
+
+
+def test_without_numpy(monkeypatch):
+    monkeypatch.setattr(bounding_boxes, "np", None)
+    objects = random_objects(30, 0)
+    expected = _clean_objs(copy.deepcopy(objects))
+    assert clean_objs(objects) == expected
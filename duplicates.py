@@ -0,0 +1,82 @@
+"""
+Detect bursts of near-identical images from the same camera.
+
+Images are compared with a difference hash (dHash) computed on a tiny grayscale
+copy. A recognition result can then be reused for an image whose hash is within
+a few bits of a recent image of the same camera instead of calling the API.
+"""
+import io
+import threading
+from collections import OrderedDict, deque
+
+
+def dhash(image, size=8):
+    """
+    Difference hash of an image as an int of size * size bits.
+
+    :param image: path, file object, bytes or PIL image
+    """
+    from PIL import Image
+
+    if isinstance(image, bytes):
+        image = io.BytesIO(image)
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+        image.draft("L", (size * 8, size * 8))  # Cheap JPEG decode at 1/8 scale
+    pixels = image.convert("L").resize((size + 1, size), Image.BILINEAR).tobytes()
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = value << 1 | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class DuplicateFilter:
+    """
+    Remember the results of the last images of each camera.
+
+    Memory is bounded: at most window images are kept per camera and at most
+    max_cameras cameras, the least recently seen camera is forgotten first.
+    """
+
+    def __init__(self, threshold=4, window=20, max_cameras=1000):
+        self.threshold = threshold
+        self.window = window
+        self.max_cameras = max_cameras
+        self.hits = 0
+        self.misses = 0
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, camera, image_hash):
+        """Return the result stored for a near-identical recent image or None."""
+        with self._lock:
+            recent = self._recent.get(camera)
+            if recent is not None:
+                self._recent.move_to_end(camera)
+                for other, result in reversed(recent):
+                    if hamming(image_hash, other) <= self.threshold:
+                        self.hits += 1
+                        return result
+            self.misses += 1
+            return None
+
+    def add(self, camera, image_hash, result):
+        with self._lock:
+            recent = self._recent.get(camera)
+            if recent is None:
+                recent = self._recent[camera] = deque(maxlen=self.window)
+                if len(self._recent) > self.max_cameras:
+                    self._recent.popitem(last=False)
+            self._recent.move_to_end(camera)
+            recent.append((image_hash, result))
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"Duplicates: {self.hits} of {total} images ({rate:.1f}%) reused a recent result"
@@ -0,0 +1,84 @@
+import io
+import json
+from unittest import mock
+
+import requests
+from PIL import Image, ImageDraw
+
+from duplicates import DuplicateFilter, dhash, hamming
+from plate_recognition import RecognitionClient
+
+
+def frame(car_x, brightness=0):
+    image = Image.new("RGB", (640, 480), (90 + brightness, 90, 100))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 300, 640, 480), fill=(60 + brightness, 60, 60))
+    draw.rectangle((car_x, 250, car_x + 200, 360), fill=(200, 30 + brightness, 30))
+    buffer = io.BytesIO()
+    image.save(buffer, "jpeg", quality=90)
+    return buffer.getvalue()
+
+
+def test_dhash_of_near_identical_frames():
+    parked = dhash(frame(100))
+    assert hamming(parked, dhash(frame(100, brightness=5))) <= 4
+    assert hamming(parked, dhash(frame(400))) > 4
+    assert dhash(io.BytesIO(frame(100))) == parked
+    assert 0 <= parked < 2**64
+
+
+def test_duplicate_filter_is_per_camera():
+    duplicates = DuplicateFilter(threshold=2)
+    duplicates.add("cam1", 0b1111, "first")
+    assert duplicates.get("cam1", 0b1101) == "first"
+    assert duplicates.get("cam1", 0b0000) is None
+    assert duplicates.get("cam2", 0b1111) is None
+    assert (duplicates.hits, duplicates.misses) == (1, 2)
+    assert "1 of 3 images (33.3%)" in duplicates.summary()
+
+
+def test_duplicate_filter_is_bounded():
+    duplicates = DuplicateFilter(threshold=0, window=2, max_cameras=2)
+    for i in range(3):
+        duplicates.add("cam1", i, i)
+    assert duplicates.get("cam1", 0) is None
+    assert duplicates.get("cam1", 2) == 2
+    duplicates.add("cam2", 0, 0)
+    duplicates.add("cam3", 0, 0)
+    assert duplicates.get("cam1", 2) is None
+    assert duplicates.get("cam3", 0) == 0
+
+
+@mock.patch.object(requests.Session, "post")
+def test_client_reuses_result_of_near_duplicate(mock_post):
+    text = json.dumps(
+        {
+            "results": [{"plate": "abc123"}],
+            "camera_id": "cam1",
+            "filename": "first.jpg",
+            "timestamp": "2024-01-01T00:00:00.000Z",
+            "processing_time": 50.0,
+        }
+    )
+    mock_post.return_value = mock.Mock(
+        status_code=200, text=text, content=text.encode(), headers={}
+    )
+    client = RecognitionClient(duplicates=DuplicateFilter(threshold=4))
+
+    def recognize(image, camera_id="cam1", name="first.jpg"):
+        fp = io.BytesIO(image)
+        fp.name = name
+        return client.recognize(fp, api_key="KEY", camera_id=camera_id)
+
+    first = recognize(frame(100))
+    first["results"].clear()  # Callers may modify the result
+    second = recognize(frame(100, brightness=5), name="second.jpg")
+    assert second["results"] == [{"plate": "abc123"}]
+    assert second["filename"] == "second.jpg"
+    assert second["duplicate_of"] == "first.jpg"
+    assert second["processing_time"] == 0.0
+    assert second["timestamp"] != "2024-01-01T00:00:00.000Z"
+    assert mock_post.call_count == 1
+    recognize(frame(400))
+    recognize(frame(100), camera_id="cam2")
+    assert mock_post.call_count == 3
@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 import argparse
-import json
 import logging
 import os
 import sys
@@ -10,10 +9,18 @@ import ftplib
 from abc import ABC, abstractmethod
 from datetime import datetime, timedelta
 from ftplib import FTP, error_perm, error_reply
+from pathlib import Path
 
 import paramiko
 
-from plate_recognition import recognition_api, save_results
+from duplicates import DuplicateFilter
+from metrics import enable_metrics, timed
+from plate_recognition import (
+    RecognitionClient,
+    open_writer,
+    recognition_api,
+    set_client,
+)
 
 LOG_LEVEL = os.environ.get("LOGGING", "INFO").upper()
 
@@ -80,39 +87,39 @@ class FileTransferProcessor(ABC):
             nondirs = []
             file_list = self.list_files()
 
-        for info in file_list:
-            name = info[-1]
-            ls_type = info[0] if self.os_linux else info[-2]
-            if ls_type.startswith("d") or ls_type == "<DIR>":
-                # Don't process files any deeper
-                pass
-            else:
-                if self.os_linux:
-                    nondirs.append(
-                        [name, self.parse_date(info[-4], info[-3], info[-2])]
-                    )
+            for info in file_list:
+                name = info[-1]
+                ls_type = info[0] if self.os_linux else info[-2]
+                if ls_type.startswith("d") or ls_type == "<DIR>":
+                    # Don't process files any deeper
+                    pass
                 else:
-                    file_date = info[0].split("-")
-                    file_time = info[1]
-
-                    if "AM" in file_time or "PM" in file_time:
-                        parsed_time = datetime.strptime(file_time, "%I:%M%p")
-                        file_time = parsed_time.strftime(
-                            "%H:%M"
-                        )  # from AM/PM to 24-hour format
-
-                    nondirs.append(
-                        [
-                            name,
-                            self.parse_date(
-                                file_date[0], file_date[1], file_time, linux=False
-                            ),
-                        ]
-                    )
-
-        logging.info("Found %s file(s) in %s.", len(
-            nondirs), self.get_working_directory())
-        self.process_files(nondirs)
+                    if self.os_linux:
+                        nondirs.append(
+                            [name, self.parse_date(info[-4], info[-3], info[-2])]
+                        )
+                    else:
+                        file_date = info[0].split("-")
+                        file_time = info[1]
+
+                        if "AM" in file_time or "PM" in file_time:
+                            parsed_time = datetime.strptime(file_time, "%I:%M%p")
+                            file_time = parsed_time.strftime(
+                                "%H:%M"
+                            )  # from AM/PM to 24-hour format
+
+                        nondirs.append(
+                            [
+                                name,
+                                self.parse_date(
+                                    file_date[0], file_date[1], file_time, linux=False
+                                ),
+                            ]
+                        )
+
+            logging.info("Found %s file(s) in %s.", len(
+                nondirs), self.get_working_directory())
+            self.process_files(nondirs)
 
     def track_processed(self):
         """
@@ -141,41 +148,41 @@ class FileTransferProcessor(ABC):
                 self.processed.remove(file)
 
     def process_files(self, ftp_files):
-        results = []
-        for file_last_modified in ftp_files:
-            ftp_file = file_last_modified[0]
-            last_modified = file_last_modified[1]
-
-            if self.delete is not None:
-                self.manage_processed_file(ftp_file, last_modified)
-                continue
-
-            logging.info(ftp_file)
-
-            with tempfile.NamedTemporaryFile(
-                suffix="_" + ftp_file, mode="rb+"
-            ) as image:
-
-                self.set_ftp_binary_file(ftp_file, image)
-                api_res = recognition_api(
-                    image,
-                    self.regions,
-                    self.api_key,
-                    self.sdk_url,
-                    camera_id=self.camera_id,
-                    timestamp=self.timestamp,
-                    mmc=self.mmc,
-                    exit_on_error=False,
-                )
-                results.append(api_res)
-
-            if self.track_processed():
-                self.processed.append(ftp_file)
-
-        if self.output_file:
-            save_results(results, self)
-        else:
-            print(json.dumps(results, indent=2))
+        if self.output_file and not Path(self.output_file).parent.exists():
+            print(f"{self.output_file} does not exist")
+            return
+        with open_writer(self.output_file, self.format) as writer:
+            for file_last_modified in ftp_files:
+                ftp_file = file_last_modified[0]
+                last_modified = file_last_modified[1]
+
+                if self.delete is not None:
+                    self.manage_processed_file(ftp_file, last_modified)
+                    continue
+
+                logging.info(ftp_file)
+
+                with tempfile.NamedTemporaryFile(
+                    suffix="_" + ftp_file, mode="rb+"
+                ) as image:
+
+                    with timed("download"):
+                        self.set_ftp_binary_file(ftp_file, image)
+                    api_res = recognition_api(
+                        image,
+                        self.regions,
+                        self.api_key,
+                        self.sdk_url,
+                        camera_id=self.camera_id,
+                        timestamp=self.timestamp,
+                        mmc=self.mmc,
+                        exit_on_error=False,
+                    )
+                    with timed("write"):
+                        writer.write(api_res)
+
+                if self.track_processed():
+                    self.processed.append(ftp_file)
 
     def get_files_and_dirs(func):
         def wrapper(self):
@@ -463,8 +470,10 @@ ftp_and_sftp_processor.py -H host -U user1 -P pass -s http://localhost:8080
     parser.add_argument(
         "-s",
         "--sdk-url",
-        help="Url to self hosted sdk  For example, http://localhost:8080",
+        help="Url to self hosted sdk  For example, http://localhost:8080. "
+        "Repeat to spread the calls over several SDK instances.",
         required=False,
+        action="append",
     )
     parser.add_argument(
         "--camera-id", help="Name of the source camera.", required=False
@@ -517,7 +526,7 @@ ftp_and_sftp_processor.py -c sftp -U usr1  -P pass -H 192.168.0.59 -f /tmp/image
 """
     parser.add_argument("-t", "--timestamp", help="Timestamp.", required=False)
     parser.add_argument("-H", "--hostname", help="host", required=True)
-    parser.add_argument("-p", "--port", help="port", required=False)
+    parser.add_argument("-p", "--port", help="port", type=int, required=False)
     parser.add_argument(
         "-U", "--ftp-user", help="Transfer protocol server user", required=True
     )
@@ -550,7 +559,7 @@ ftp_and_sftp_processor.py -c sftp -U usr1  -P pass -H 192.168.0.59 -f /tmp/image
         "--format",
         help="Format of the result.",
         default="json",
-        choices="json csv".split(),
+        choices="json jsonl csv".split(),
     )
     parser.add_argument(
         "--mmc",
@@ -563,6 +572,22 @@ ftp_and_sftp_processor.py -c sftp -U usr1  -P pass -H 192.168.0.59 -f /tmp/image
         type=int,
         help="Periodically fetch new images from the server every interval seconds.",
     )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Expose the duration of each processing stage on http://0.0.0.0:PORT/metrics (Prometheus format).",
+    )
+    parser.add_argument(
+        "--dedup-threshold",
+        type=int,
+        help="Reuse the result of a recent image of the same camera when the perceptual hashes differ by at most this many bits (out of 64), for example 4.",
+    )
+    parser.add_argument(
+        "--dedup-window",
+        type=int,
+        default=20,
+        help="Number of recent images per camera compared with --dedup-threshold.",
+    )
 
     def default_port():
         return 21 if parser.parse_args().protocol == "ftp" else 22
@@ -605,6 +630,12 @@ def ftp_process(args):
 
 def main():
     args = parse_arguments(custom_args)
+    if args.metrics_port:
+        enable_metrics().serve(args.metrics_port)
+    duplicates = None
+    if args.dedup_threshold is not None:
+        duplicates = DuplicateFilter(args.dedup_threshold, args.dedup_window)
+        set_client(RecognitionClient(duplicates=duplicates))
 
     if args.interval and args.interval > 0:
         while True:
@@ -612,9 +643,13 @@ def main():
                 ftp_process(args)
             except Exception as e:
                 print(f"ERROR: {e}")
+            if duplicates:
+                logging.info(duplicates.summary())
             time.sleep(args.interval)
     else:
         ftp_process(args)
+        if duplicates:
+            logging.info(duplicates.summary())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,63 @@
+import sys
+from unittest import mock
+
+from ftp_and_sftp_processor import (
+    FileTransferProcessor,
+    custom_args,
+    parse_arguments,
+)
+
+
+class FakeProcessor(FileTransferProcessor):
+    """Serves listings from a dict of folder: [ls lines]."""
+
+    def __init__(self, folders, **kwargs):
+        super().__init__(**kwargs)
+        self.folders = folders
+        self.cwd = "/"
+        self.os_linux = True
+
+    def connect(self):
+        pass
+
+    def delete_file(self, file):
+        pass
+
+    def list_files(self):
+        return [line.split() for line in self.folders[self.cwd]]
+
+    def set_ftp_binary_file(self, file, image):
+        pass
+
+    def set_working_directory(self, path):
+        self.cwd = path
+
+    def get_working_directory(self):
+        return self.cwd
+
+    def retrieve_files(self):
+        dirs = ["cam1", "cam2"]
+        return [], dirs, [["root.jpg", None]]
+
+
+def test_processing_single_camera_sends_each_file_once():
+    ls = "-rw-r--r-- 1 user group 100 Jan 01 10:00 {}"
+    processor = FakeProcessor(
+        {
+            "./cam1": [ls.format("a.jpg"), ls.format("b.jpg")],
+            "./cam2": [ls.format("c.jpg")],
+        }
+    )
+    args = mock.Mock(folder="/")
+    with mock.patch.object(FakeProcessor, "process_files") as process_files:
+        processor.processing_single_camera(args)
+    sent = [[name for name, _ in call.args[0]] for call in process_files.call_args_list]
+    assert sent == [["root.jpg"], ["a.jpg", "b.jpg"], ["c.jpg"]]
+
+
+def test_port_is_an_int(monkeypatch):
+    argv = ["ftp_and_sftp_processor.py", "-a", "KEY", "-H", "host", "-U", "user"]
+    monkeypatch.setattr(sys, "argv", argv + ["-p", "2121"])
+    assert parse_arguments(custom_args).port == 2121
+    monkeypatch.setattr(sys, "argv", argv + ["-c", "sftp"])
+    assert parse_arguments(custom_args).port == 22
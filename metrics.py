@@ -0,0 +1,148 @@
+"""
+Optional latency histograms of the processing stages.
+
+Instrumentation is disabled until enable_metrics() is called, timed() is then
+a no-op context manager. Results can be printed as a table or exported in the
+Prometheus text format.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+
+class Metrics:
+    """Histograms of durations in seconds, per stage and endpoint."""
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, endpoint=""):
+        with self._lock:
+            histogram = self.histograms.get((stage, endpoint))
+            if histogram is None:
+                histogram = self.histograms[(stage, endpoint)] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage, endpoint=""):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, endpoint)
+
+    def summary(self):
+        """Markdown table of the durations in milliseconds."""
+        lines = [
+            "| Stage           | Endpoint                       | Count   | Mean    | p50     | p95     | Max     |",
+            "| --------------- | ------------------------------ | ------- | ------- | ------- | ------- | ------- |",
+        ]
+        with self._lock:
+            for (stage, endpoint), h in sorted(self.histograms.items()):
+                lines.append(
+                    f"| {stage:15s} | {endpoint:30s} | {h.count:7d} "
+                    f"| {h.sum / h.count * 1000:7.1f} | {h.quantile(0.5) * 1000:7.1f} "
+                    f"| {h.quantile(0.95) * 1000:7.1f} | {h.max * 1000:7.1f} |"
+                )
+        return "\n".join(lines)
+
+    def prometheus(self):
+        name = "platerec_stage_duration_seconds"
+        lines = [
+            f"# HELP {name} Duration of the processing stages.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            for (stage, endpoint), h in sorted(self.histograms.items()):
+                labels = f'stage="{stage}",endpoint="{endpoint}"'
+                cumulative = 0
+                for i, bound in enumerate(BUCKETS + ("+Inf",)):
+                    cumulative += h.counts[i]
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {h.sum}")
+                lines.append(f"{name}_count{{{labels}}} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="0.0.0.0"):
+        """Expose /metrics from a background thread."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+_metrics = None
+
+
+def enable_metrics():
+    """Start recording durations and return the shared Metrics."""
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
+
+
+def get_metrics():
+    return _metrics
+
+
+def timed(stage, endpoint=""):
+    """Context manager recording the duration of a stage when metrics are enabled."""
+    if _metrics is None:
+        return nullcontext()
+    return _metrics.timer(stage, endpoint)
+
+
+def observe(stage, seconds, endpoint=""):
+    if _metrics is not None:
+        _metrics.observe(stage, seconds, endpoint)
@@ -0,0 +1,60 @@
+import urllib.request
+
+import metrics
+from metrics import Histogram, Metrics
+
+
+def test_histogram_quantiles():
+    histogram = Histogram()
+    for value in [0.002] * 90 + [0.2] * 10:
+        histogram.observe(value)
+    assert histogram.count == 100
+    assert 0.001 <= histogram.quantile(0.5) <= 0.0025
+    assert 0.1 <= histogram.quantile(0.95) <= 0.2
+    assert histogram.quantile(1) == 0.2
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_summary_and_prometheus():
+    m = Metrics()
+    m.observe("network", 0.03, "http://sdk:8080")
+    m.observe("network", 0.07, "http://sdk:8080")
+    with m.timer("decode"):
+        pass
+    summary = m.summary().splitlines()
+    assert len(summary) == 4
+    assert summary[3].startswith("| network         | http://sdk:8080")
+    assert "|    50.0 |" in summary[3]
+
+    text = m.prometheus()
+    labels = 'stage="network",endpoint="http://sdk:8080"'
+    assert f'platerec_stage_duration_seconds_bucket{{{labels},le="0.05"}} 1' in text
+    assert f'platerec_stage_duration_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+    assert f"platerec_stage_duration_seconds_count{{{labels}}} 2" in text
+
+
+def test_timed_is_noop_until_enabled(monkeypatch):
+    monkeypatch.setattr(metrics, "_metrics", None)
+    with metrics.timed("read"):
+        pass
+    metrics.observe("server", 1)
+    assert metrics.get_metrics() is None
+
+    m = metrics.enable_metrics()
+    with metrics.timed("read"):
+        pass
+    metrics.observe("server", 1)
+    assert m.histograms[("read", "")].count == 1
+    assert m.histograms[("server", "")].count == 1
+
+
+def test_serve():
+    m = Metrics()
+    m.observe("write", 0.001)
+    server = m.serve(0, host="127.0.0.1")
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            assert 'stage="write"' in response.read().decode()
+    finally:
+        server.shutdown()
@@ -1,16 +1,41 @@
+import functools
+import hashlib
+import importlib.util
 import io
 import json
 import math
+import os
 import re
-from itertools import combinations
+import sys
+import tempfile
+import threading
+from collections import deque
 from pathlib import Path
 
 from PIL import Image, ImageFilter
 
-from plate_recognition import draw_bb, parse_arguments, recognition_api
-
-
-def blur(im, blur_amount, api_res, ignore_no_bb=False, ignore_list=None):
+from bounding_boxes import merge_results, post_processing
+from plate_recognition import (
+    CLOUD_API_URL,
+    RecognitionClient,
+    draw_bb,
+    imap_bounded,
+    iter_files,
+    parse_arguments,
+    recognition_api,
+    set_client,
+)
+
+
+def boxes_to_blur(im, blur_amount, api_res, ignore_no_bb=False, ignore_list=None):
+    """
+    Return the (xmin, ymin, xmax, ymax, radius) of the plates to blur.
+
+    Plates without a vehicle are skipped with ignore_no_bb and plates matching
+    one of the regexes of ignore_list are always skipped. The blur radius grows
+    with the size of the box.
+    """
+    boxes = []
     for res in api_res.get("results", []):
         if ignore_no_bb and res["vehicle"]["score"] == 0.0:
             continue
@@ -26,117 +51,382 @@ def blur(im, blur_amount, api_res, ignore_no_bb=False, ignore_list=None):
 
         b = res["box"]
         width, height = b["xmax"] - b["xmin"], b["ymax"] - b["ymin"]
-        crop_box = (b["xmin"], b["ymin"], b["xmax"], b["ymax"])
-        ic = im.crop(crop_box)
-
         # Increase amount of blur with size of bounding box
-        blur_image = ic.filter(
-            ImageFilter.GaussianBlur(
-                radius=math.sqrt(width * height) * 0.3 * blur_amount / 10
-            )
-        )
+        radius = math.sqrt(width * height) * 0.3 * blur_amount / 10
+        xmin, ymin = max(b["xmin"], 0), max(b["ymin"], 0)
+        xmax, ymax = min(b["xmax"], im.width), min(b["ymax"], im.height)
+        if xmax > xmin and ymax > ymin:
+            boxes.append((xmin, ymin, xmax, ymax, radius))
+    return boxes
+
+
+def blur(
+    im, blur_amount, api_res, ignore_no_bb=False, ignore_list=None, mode="gaussian"
+):
+    for xmin, ymin, xmax, ymax, radius in boxes_to_blur(
+        im, blur_amount, api_res, ignore_no_bb, ignore_list
+    ):
+        crop_box = (xmin, ymin, xmax, ymax)
+        ic = im.crop(crop_box)
+        if mode == "pixelate":
+            blur_image = pixelate(ic, max(2, int(radius)))
+        else:
+            blur_image = ic.filter(ImageFilter.GaussianBlur(radius=radius))
         im.paste(blur_image, crop_box)
     return im
 
 
-def bb_iou(a, b):
-    # determine the (x, y)-coordinates of the intersection rectangle
-    x_a = max(a["xmin"], b["xmin"])
-    y_a = max(a["ymin"], b["ymin"])
-    x_b = min(a["xmax"], b["xmax"])
-    y_b = min(a["ymax"], b["ymax"])
+def _box_blur(a, radius):
+    """Blur the first two axes of a float array with a box filter of the given radius."""
+    import numpy as np
+
+    size = 2 * radius + 1
+    for axis in (0, 1):
+        pad = [(0, 0)] * a.ndim
+        pad[axis] = (radius + 1, radius)
+        c = np.cumsum(np.pad(a, pad, mode="edge"), axis=axis)
+        c = np.moveaxis(c, axis, 0)
+        n = a.shape[axis]
+        a = np.moveaxis((c[size : size + n] - c[:n]) / size, 0, axis)
+    return a
+
+
+@functools.lru_cache(maxsize=None)
+def _opencv():
+    try:
+        import cv2
+    except ImportError:
+        return None
+    return cv2
+
+
+def _gaussian_blur(region, sigma):
+    """
+    Approximate a Gaussian blur of an RGB image.
+
+    Large radii are applied on a copy reduced by the returned factor, the blur
+    itself is done with OpenCV when it is installed, otherwise with three box
+    filters. Returns (blurred array, factor).
+    """
+    import numpy as np
+
+    cv2 = _opencv()
+    factor = max(1, min(int(sigma / 2), region.width // 4, region.height // 4))
+    if factor > 1:
+        region = region.reduce(factor)
+    sigma /= factor
+    small = np.asarray(region)
+    if cv2:
+        return cv2.GaussianBlur(small, (0, 0), sigma), factor
+    # Three box filters of this width have the variance of the Gaussian
+    radius = max(1, round((math.sqrt(4 * sigma * sigma + 1) - 1) / 2))
+    blurred = small.astype(np.float32)
+    for _ in range(3):
+        blurred = _box_blur(blurred, radius)
+    return blurred.round().astype(np.uint8), factor
+
+
+def pixelate(im, block):
+    """Replace each block x block square of an image by its mean color."""
+    cols, rows = -(-im.width // block), -(-im.height // block)
+    mosaic = im.reduce(block).resize((cols * block, rows * block), Image.NEAREST)
+    return mosaic.crop((0, 0, im.width, im.height))
+
+
+def _merge_boxes(boxes, margin):
+    """Group boxes whose areas extended by margin overlap."""
+    groups = [[box] for box in boxes]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(groups)):
+            a = _extent(groups[i], margin)
+            for j in range(i + 1, len(groups)):
+                b = _extent(groups[j], margin)
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    groups[i] += groups.pop(j)
+                    merged = True
+                    break
+            if merged:
+                break
+    return groups
 
-    # compute the area of both the prediction and ground-truth
-    # rectangles
-    area_a = (a["xmax"] - a["xmin"]) * (a["ymax"] - a["ymin"])
-    area_b = (b["xmax"] - b["xmin"]) * (b["ymax"] - b["ymin"])
 
-    # compute the area of intersection rectangle
-    area_inter = max(0, x_b - x_a) * max(0, y_b - y_a)
-    return area_inter / float(max(area_a + area_b - area_inter, 1))
+def _extent(boxes, margin=0):
+    return (
+        min(box[0] for box in boxes) - margin,
+        min(box[1] for box in boxes) - margin,
+        max(box[2] for box in boxes) + margin,
+        max(box[3] for box in boxes) + margin,
+    )
 
 
-def clean_objs(objects, threshold=0.1):
-    # Only keep the ones with best score or no overlap
-    for o1, o2 in combinations(objects, 2):
-        if (
-            "remove" in o1
-            or "remove" in o2
-            or bb_iou(o1["box"], o2["box"]) <= threshold
-        ):
+def blur_numpy(
+    im, blur_amount, api_res, ignore_no_bb=False, ignore_list=None, mode="gaussian"
+):
+    """
+    Same as blur() using NumPy, and OpenCV when it is installed.
+
+    Boxes are grouped by blur radius (rounded to a power of sqrt(2)) and nearby
+    boxes of a group share one blurred region. Only these regions are converted
+    to arrays. Neighbouring pixels are used at the edges of the boxes instead of
+    mirroring the box content.
+    """
+    levels = {}
+    for box in boxes_to_blur(im, blur_amount, api_res, ignore_no_bb, ignore_list):
+        level = round(2 * math.log2(max(box[4], 1)))
+        levels.setdefault(level, []).append(box)
+    for level, level_boxes in levels.items():
+        radius = 2 ** (level / 2)
+        if mode == "pixelate":
+            # PIL reduces blocks as fast as NumPy, nothing to group
+            for xmin, ymin, xmax, ymax, box_radius in level_boxes:
+                crop_box = (xmin, ymin, xmax, ymax)
+                im.paste(pixelate(im.crop(crop_box), max(2, int(box_radius))), crop_box)
             continue
-        if o1["score"] > o2["score"]:
-            o2["remove"] = True
-        else:
-            o1["remove"] = True
-    return [x for x in objects if "remove" not in x]
-
-
-def merge_results(images):
-    result = dict(results=[])
-    for data in images:
-        for item in data["prediction"]["results"]:
-            result["results"].append(item)
-            for b in [item["box"], item["vehicle"].get("box", {})]:
-                b["ymin"] += data["y"]
-                b["xmin"] += data["x"]
-                b["ymax"] += data["y"]
-                b["xmax"] += data["x"]
-    result["results"] = clean_objs(result["results"])
-    return result
+        margin = int(2 * radius)
+        for group in _merge_boxes(level_boxes, margin):
+            x0, y0, x1, y1 = _extent(group, margin)
+            x0, y0 = max(x0, 0), max(y0, 0)
+            x1, y1 = min(x1, im.width), min(y1, im.height)
+            blurred, factor = _gaussian_blur(im.crop((x0, y0, x1, y1)), radius)
+            blurred = Image.fromarray(blurred)
+            for xmin, ymin, xmax, ymax, _ in group:
+                # Scale back up only the boxes
+                source_box = [
+                    (xmin - x0) / factor,
+                    (ymin - y0) / factor,
+                    (xmax - x0) / factor,
+                    (ymax - y0) / factor,
+                ]
+                patch = blurred.resize(
+                    (xmax - xmin, ymax - ymin), Image.BILINEAR, box=source_box
+                )
+                im.paste(patch, (xmin, ymin, xmax, ymax))
+    return im
 
 
-def inside(a, b):
-    return (
-        a["xmin"] > b["xmin"]
-        and a["ymin"] > b["ymin"]
-        and a["xmax"] < b["xmax"]
-        and a["ymax"] < b["ymax"]
-    )
+BLUR_ENGINES = {"pil": blur, "numpy": blur_numpy}
 
 
-def post_processing(results):
-    new_list = []
-    for item in results["results"]:
-        if item["score"] < 0.2 and any(
-            [inside(x["box"], item["box"]) for x in results["results"] if x != item]
-        ):
-            continue
-        new_list.append(item)
-    results["results"] = new_list
-    return results
+BYTES_PER_PIXEL = 4  # PIL stores RGB pixels in 32 bits
 
 
-def process_image(path, args, i):
+def _recognize(im, args):
     config = dict(
         threshold_d=args.detection_threshold,
         threshold_o=args.ocr_threshold,
         mode="redaction",
     )
+    im_bytes = io.BytesIO()
+    im.save(im_bytes, "JPEG", quality=95)
+    im_bytes.seek(0)
+    return recognition_api(
+        im_bytes, args.regions, args.api_key, args.sdk_url, config=config
+    )
+
 
-    # Predictions
-    source_im = Image.open(path)
-    if source_im.mode != "RGB":
-        source_im = source_im.convert("RGB")
-    images = [((0, 0), source_im)]  # Entire image
-    # Top left and top right crops
-    if args.split_image:
-        y = 0
-        win_size = 0.55
-        width, height = source_im.width * win_size, source_im.height * win_size
-        for x in [0, int((1 - win_size) * source_im.width)]:
-            images.append(((x, y), source_im.crop((x, y, x + width, y + height))))
-
-    # Inference
+_open_lock = threading.Lock()
+
+
+def _open_unbounded(path):
+    """
+    Open an image without the decompression bomb check of PIL.
+
+    The --max-memory checks replace it for these files only, the limit is
+    restored for the other callers of Image.open.
+    """
+    with _open_lock:
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            return Image.open(path)
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+
+def open_reduced(path, max_memory):
+    """
+    Decode an image using at most max_memory MB.
+
+    The returned image uses at most a quarter of max_memory. JPEG files are
+    decoded directly at 1/2, 1/4 or 1/8 of their size. Other formats are
+    decoded at full size and reduced, when both fit in max_memory.
+
+    :return: (RGB image, size of the original image)
+    """
+    max_pixels = max_memory * 1024**2 // BYTES_PER_PIXEL // 4
+    im = _open_unbounded(path)
+    width, height = im.size
+    factor = math.ceil(math.sqrt(width * height / max_pixels))
+    if factor > 1:
+        im.draft("RGB", (width // factor, height // factor))
+    copies = 1 if im.mode == "RGB" else 2
+    if im.width * im.height * copies + max_pixels > max_pixels * 4:
+        raise ValueError(
+            f"{path}: {width}x{height} pixels can't be decoded with the "
+            "--max-memory limit"
+        )
+    if im.mode != "RGB":
+        im = im.convert("RGB")
+    im.load()
+    factor = math.ceil(math.sqrt(im.width * im.height / max_pixels))
+    if factor > 1:
+        im = im.reduce(factor)
+    return im, (width, height)
+
+
+def tile_boxes(width, height, size, overlap):
+    """Yield the (xmin, ymin, xmax, ymax) of overlapping tiles covering an image."""
+    step = size - overlap
+    for y in range(0, max(height - overlap, 1), step):
+        for x in range(0, max(width - overlap, 1), step):
+            yield x, y, min(x + size, width), min(y + size, height)
+
+
+def detect_tiles(path, args):
+    """
+    Call the API on tiles of the image, decoded at a reduced size if needed.
+
+    A thumbnail of the whole image is also sent to find plates larger than
+    the tile overlap.
+
+    :return: (size of the image, predictions in full resolution coordinates)
+    """
+    from plate_recognition import scale_boxes
+
+    im, size = open_reduced(path, args.max_memory)
+    scale = size[0] / im.width
+    if scale > 1:
+        print(
+            f"{path}: detection on an image reduced {scale:.1f} times to stay "
+            "under --max-memory",
+            file=sys.stderr,
+        )
     results = []
-    for (x, y), im in images:
-        im_bytes = io.BytesIO()
-        im.save(im_bytes, "JPEG", quality=95)
-        im_bytes.seek(0)
-        im_results = recognition_api(
-            im_bytes, args.regions, args.api_key, args.sdk_url, config=config
+    if max(im.size) > args.tile_size:
+        thumbnail = im.copy()
+        thumbnail.thumbnail((args.tile_size, args.tile_size))
+        api_res = scale_boxes(_recognize(thumbnail, args), size[0] / thumbnail.width)
+        del thumbnail
+        results.append(dict(prediction=api_res, x=0, y=0))
+    for box in tile_boxes(im.width, im.height, args.tile_size, args.tile_size // 8):
+        api_res = scale_boxes(_recognize(im.crop(box), args), scale)
+        results.append(
+            dict(prediction=api_res, x=round(box[0] * scale), y=round(box[1] * scale))
         )
-        results.append(dict(prediction=im_results, x=x, y=y))
+    return size, results
+
+
+SIDECAR_SUFFIX = ".redaction.json"
+
+
+def detection_key(path, args):
+    """Hash of the image bytes and of the parameters that change the detections."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1024**2), b""):
+            digest.update(chunk)
+    # Instances given with several --sdk-url are expected to run the same model
+    endpoint = sorted(args.sdk_url) if args.sdk_url else CLOUD_API_URL
+    params = [
+        endpoint,
+        args.regions or [],
+        args.detection_threshold,
+        args.ocr_threshold,
+        args.split_image,
+        args.max_memory,
+        args.tile_size if args.max_memory else None,
+    ]
+    digest.update(json.dumps(params).encode())
+    return digest.hexdigest()
+
+
+def load_detections(path, key):
+    """
+    Return the detections saved next to the image with this key or None.
+
+    A corrupt sidecar file is removed, the image is then detected again.
+    """
+    sidecar_path = f"{path}{SIDECAR_SUFFIX}"
+    try:
+        with open(sidecar_path) as fp:
+            sidecar = json.load(fp)
+    except OSError:
+        return None
+    except ValueError:  # Not JSON, for example a truncated file
+        sidecar = None
+    if not isinstance(sidecar, dict) or "results" not in sidecar:
+        print(f"{path}: ignoring corrupt {sidecar_path}", file=sys.stderr)
+        try:
+            os.remove(sidecar_path)
+        except OSError:
+            pass
+        return None
+    if sidecar.get("key") != key:
+        return None
+    return sidecar["results"]
+
+
+def save_detections(path, key, results):
+    """Save the detections next to the image, only warn when it is not writable."""
+    sidecar = Path(f"{path}{SIDECAR_SUFFIX}")
+    tmp = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            "w", dir=sidecar.parent, suffix=".tmp", delete=False
+        ) as fp:
+            tmp = fp.name
+            json.dump(dict(key=key, results=results), fp)
+        os.replace(tmp, sidecar)
+    except OSError as e:
+        print(f"{path}: detections not cached, {e}", file=sys.stderr)
+        if tmp and os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def detect(path, args):
+    """
+    Return the image and the padded plate boxes found by the API.
+
+    With --max-memory, ValueError is raised for images that can't be blurred
+    within the limit. With --max-memory or when the detections are read from the sidecar file of
+    --cache-detections, the image is not decoded and None is returned instead.
+    """
+    if args.max_memory and (args.save_blurred or args.show_boxes):
+        # Reject the image before paying for the API calls
+        check_full_resolution(path, args.max_memory)
+    key = None
+    if args.cache_detections:
+        key = detection_key(path, args)
+        results = load_detections(path, key)
+        if results is not None:
+            return None, results
+
+    if args.max_memory:
+        source_im = None
+        (width, height), results = detect_tiles(path, args)
+    else:
+        # Predictions
+        source_im = Image.open(path)
+        if source_im.mode != "RGB":
+            source_im = source_im.convert("RGB")
+        width, height = source_im.size
+        images = [((0, 0), source_im)]  # Entire image
+        # Top left and top right crops
+        if args.split_image:
+            y = 0
+            win_size = 0.55
+            crop_width, crop_height = width * win_size, height * win_size
+            for x in [0, int((1 - win_size) * width)]:
+                images.append(
+                    ((x, y), source_im.crop((x, y, x + crop_width, y + crop_height)))
+                )
+
+        # Inference
+        results = []
+        for (x, y), im in images:
+            results.append(dict(prediction=_recognize(im, args), x=x, y=y))
     results = post_processing(merge_results(results))
     results["filename"] = Path(path).name
 
@@ -144,35 +434,166 @@ def process_image(path, args, i):
     for item in results["results"]:
         # Decrease padding size for large bounding boxes
         b = item["box"]
-        width, height = b["xmax"] - b["xmin"], b["ymax"] - b["ymin"]
-        padding_x = int(max(0, width * (0.3 * math.exp(-10 * width / source_im.width))))
+        box_width, box_height = b["xmax"] - b["xmin"], b["ymax"] - b["ymin"]
+        padding_x = int(max(0, box_width * (0.3 * math.exp(-10 * box_width / width))))
         padding_y = int(
-            max(0, height * (0.3 * math.exp(-10 * height / source_im.height)))
+            max(0, box_height * (0.3 * math.exp(-10 * box_height / height)))
         )
         b["xmin"] = b["xmin"] - padding_x
         b["ymin"] = b["ymin"] - padding_y
         b["xmax"] = b["xmax"] + padding_x
         b["ymax"] = b["ymax"] + padding_y
-
-    if args.show_boxes or args.save_blurred:
-        im = blur(
-            source_im,
-            5,
-            results,
-            ignore_no_bb=args.ignore_no_bb,
-            ignore_list=args.ignore_regexp,
-        )
-
-        if args.show_boxes:
-            im.show()
-        if args.save_blurred:
-            filename = Path(path)
-            im.save(filename.parent / (f"{filename.stem}_blurred{filename.suffix}"))
     if 0:
         draw_bb(source_im, results["results"]).show()
+    if key:
+        save_detections(path, key, results)
+    return source_im, results
+
+
+def check_full_resolution(path, max_memory):
+    """
+    Raise ValueError when blurring the image needs more than max_memory MB.
+
+    The output is encoded from the image decoded at full resolution, it can't
+    be written tile by tile.
+    """
+    with _open_unbounded(path) as im:
+        copies = 1 if im.mode == "RGB" else 2
+        needed = im.width * im.height * BYTES_PER_PIXEL * copies / 1024**2
+    if needed > max_memory:
+        raise ValueError(
+            f"{path}: rejected, {needed:.0f} MB are needed to blur it at full "
+            f"resolution, above --max-memory {max_memory}"
+        )
+
+
+def open_full(path, max_memory=None):
+    """Decode an image at full resolution in RGB."""
+    if max_memory:
+        check_full_resolution(path, max_memory)
+        im = _open_unbounded(path)
+    else:
+        im = Image.open(path)
+    return im if im.mode == "RGB" else im.convert("RGB")
+
+
+def peak_memory():
+    """Peak resident memory in MB of this process or of one of its children."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        import psutil
+
+        return psutil.Process().memory_info().peak_wset / 1024**2
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def redact(path, source_im, results, args):
+    if source_im is None:
+        source_im = open_full(path, args.max_memory)
+    im = BLUR_ENGINES[args.blur_engine](
+        source_im,
+        5,
+        results,
+        ignore_no_bb=args.ignore_no_bb,
+        ignore_list=args.ignore_regexp,
+        mode=args.blur_mode,
+    )
+
+    if args.show_boxes:
+        im.show()
+    if args.save_blurred:
+        filename = Path(path)
+        im.save(filename.parent / (f"{filename.stem}_blurred{filename.suffix}"))
+
+
+def process_image(path, args, i):
+    source_im, results = detect(path, args)
+    if args.show_boxes or args.save_blurred:
+        redact(path, source_im, results, args)
     return results
 
 
+def _redact_shared(name, size, path, results, args):
+    """Blur and save an image whose pixels are in a shared memory block."""
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name)
+    try:
+        source_im = Image.frombytes("RGB", size, shm.buf)
+    finally:
+        shm.close()
+    redact(path, source_im, results, args)
+
+
+class RedactionPool:
+    """
+    Blur and save images in a pool of processes.
+
+    The decoded pixels are handed over in shared memory instead of being
+    pickled. Images detected with --max-memory are decoded by the workers.
+    At most 2 * workers images are pending, submit() waits for the
+    oldest one beyond that.
+    """
+
+    def __init__(self, workers):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.workers = workers
+        # Forking a process while the API threads hold locks is not safe
+        self.executor = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self.pending = deque()
+
+    def submit(self, path, source_im, results, args):
+        from multiprocessing import shared_memory
+
+        if source_im is None:
+            future = self.executor.submit(redact, path, None, results, args)
+            self.pending.append((future, None))
+            self._wait()
+            return
+        pixels = source_im.tobytes()
+        shm = shared_memory.SharedMemory(create=True, size=len(pixels))
+        shm.buf[: len(pixels)] = pixels
+        del pixels
+        future = self.executor.submit(
+            _redact_shared, shm.name, source_im.size, path, results, args
+        )
+        self.pending.append((future, shm))
+        self._wait()
+
+    def _wait(self):
+        while len(self.pending) >= 2 * self.workers:
+            self._wait_oldest()
+
+    def _wait_oldest(self):
+        future, shm = self.pending.popleft()
+        try:
+            future.result()
+        finally:
+            if shm:
+                shm.close()
+                shm.unlink()
+
+    def close(self):
+        try:
+            while self.pending:
+                self._wait_oldest()
+        finally:
+            for _, shm in self.pending:
+                if shm:
+                    shm.close()
+                    shm.unlink()
+            self.executor.shutdown()
+
+
 def custom_args(parser):
     parser.epilog += "To analyse the image for redaction: python number_plate_redaction.py  --api-key MY_API_KEY --split-image /tmp/car.jpg"
     parser.add_argument(
@@ -188,6 +609,51 @@ def custom_args(parser):
         action="store_true",
         help="Blur license plates and save image in filename_blurred.jpg.",
     )
+    parser.add_argument(
+        "--blur-engine",
+        default="pil",
+        choices=sorted(BLUR_ENGINES),
+        help="numpy (requires the numpy package) blurs all the plates of an image at once and is faster with many or large plates. It uses OpenCV when it is installed.",
+    )
+    parser.add_argument(
+        "--blur-mode",
+        default="gaussian",
+        choices=["gaussian", "pixelate"],
+        help="Gaussian blur or a faster mosaic of the plates.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of images sent for recognition concurrently.",
+    )
+    parser.add_argument(
+        "--cpu-workers",
+        type=int,
+        default=0,
+        help="Number of processes blurring and saving images with --save-blurred. "
+        "By default, images are blurred in the main process. Use with --workers.",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=int,
+        help="Memory limit in MB for each image, for very large images. Plates are "
+        "detected on tiles of an image decoded at a reduced size when needed. With "
+        "--save-blurred or --show-boxes, images that don't fit at full resolution "
+        "are rejected and the exit status is 1. Replaces --split-image.",
+    )
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        default=2048,
+        help="Size of the tiles sent to the API with --max-memory.",
+    )
+    parser.add_argument(
+        "--cache-detections",
+        action="store_true",
+        help=f"Save the detections next to each image in image.jpg{SIDECAR_SUFFIX}. "
+        "When only the blur options change, the next runs do not call the API.",
+    )
     parser.add_argument(
         "--ignore-regexp",
         action="append",
@@ -214,10 +680,51 @@ def custom_args(parser):
 
 def main():
     args = parse_arguments(custom_args)
+    if args.max_memory and args.split_image:
+        sys.exit(
+            "--split-image can't be used with --max-memory, tiles are used instead."
+        )
+    if args.blur_engine == "numpy" and importlib.util.find_spec("numpy") is None:
+        sys.exit("--blur-engine numpy requires the numpy package.")
+    set_client(RecognitionClient(pool_size=max(args.workers, 10)))
+    paths = (
+        path
+        for path in iter_files(args)
+        if Path(path).is_file() and not str(path).endswith(SIDECAR_SUFFIX)
+    )
+    pool = None
+    if args.cpu_workers and args.save_blurred and not args.show_boxes:
+        pool = RedactionPool(args.cpu_workers)
+
+    def detect_path(path):
+        try:
+            return path, detect(path, args)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return path, (None, None)
+
     result = []
-    for i, path in enumerate(args.files):
-        if Path(path).is_file():
-            result.append(process_image(path, args, i))
+    rejected = 0
+    try:
+        for path, (source_im, im_results) in imap_bounded(
+            detect_path, paths, args.workers
+        ):
+            if im_results is None:
+                rejected += 1
+                continue
+            result.append(im_results)
+            if pool:
+                pool.submit(path, source_im, im_results, args)
+            elif args.show_boxes or args.save_blurred:
+                redact(path, source_im, im_results, args)
+    finally:
+        if pool:
+            pool.close()
+    if args.max_memory:
+        print(
+            f"Peak memory: {peak_memory():.0f} MB, limit {args.max_memory} MB per image",
+            file=sys.stderr,
+        )
     if 0:
         for im_result in result:
             for i, x in enumerate(im_result["results"]):
@@ -225,6 +732,8 @@ def main():
                     dscore=x["dscore"], score=x["score"], box=x["box"]
                 )
     print(json.dumps(result, indent=2))
+    if rejected:
+        sys.exit(f"{rejected} images were rejected, see the errors above.")
 
 
 if __name__ == "__main__":
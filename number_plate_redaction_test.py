@@ -0,0 +1,251 @@
+import argparse
+import json
+from unittest import mock
+
+import pytest
+from PIL import Image, ImageDraw
+
+from number_plate_redaction import (
+    SIDECAR_SUFFIX,
+    RedactionPool,
+    blur,
+    blur_numpy,
+    boxes_to_blur,
+    detect,
+    detect_tiles,
+    open_full,
+    open_reduced,
+    redact,
+    tile_boxes,
+)
+
+try:
+    import numpy as np
+except ImportError:  # Only needed by the numpy blur engine
+    np = None
+
+requires_numpy = pytest.mark.skipif(np is None, reason="requires numpy")
+
+
+def result(plate, xmin, ymin, xmax, ymax, vehicle_score=0.8):
+    return dict(
+        plate=plate,
+        box=dict(xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax),
+        vehicle=dict(score=vehicle_score),
+    )
+
+
+API_RES = dict(
+    results=[
+        result("abc123", 100, 100, 220, 140),
+        result("abc124", 210, 120, 330, 160),
+        result("xyz999", 400, 300, 520, 340),
+        result("nocar1", 10, 400, 130, 440, vehicle_score=0.0),
+        result("edge01", 580, -5, 700, 30),
+    ]
+)
+
+
+def image():
+    return Image.effect_noise((640, 480), 60).convert("RGB")
+
+
+def changed(before, after):
+    return np.any(np.asarray(before) != np.asarray(after), axis=2)
+
+
+def test_boxes_to_blur_skips_ignored_plates():
+    boxes = boxes_to_blur(image(), 5, API_RES, ignore_no_bb=True, ignore_list=["^xyz"])
+    assert [box[:4] for box in boxes] == [
+        (100, 100, 220, 140),
+        (210, 120, 330, 160),
+        (580, 0, 640, 30),
+    ]
+    assert len(boxes_to_blur(image(), 5, API_RES)) == 5
+
+
+@requires_numpy
+def test_engines_modify_the_same_pixels():
+    source = image()
+    for mode in ("gaussian", "pixelate"):
+        kwargs = dict(ignore_no_bb=True, ignore_list=["^xyz"])
+        pil = blur(source.copy(), 5, API_RES, mode=mode, **kwargs)
+        vectorized = blur_numpy(source.copy(), 5, API_RES, mode=mode, **kwargs)
+        expected = np.zeros((480, 640), dtype=bool)
+        for xmin, ymin, xmax, ymax, _ in boxes_to_blur(source, 5, API_RES, **kwargs):
+            expected[ymin:ymax, xmin:xmax] = True
+        assert not changed(source, vectorized)[~expected].any()
+        assert changed(source, vectorized)[expected].mean() > 0.9
+        assert changed(source, pil)[expected].mean() > 0.9
+        # Both engines remove the noise inside the boxes
+        noise = np.asarray(source)[expected].std()
+        assert np.asarray(vectorized)[expected].std() < noise / 2
+        assert np.asarray(pil)[expected].std() < noise / 2
+
+
+@requires_numpy
+def test_pixelate_produces_blocks():
+    source = image()
+    res = dict(results=[result("abc123", 100, 100, 220, 140)])
+    radius = boxes_to_blur(source, 5, res)[0][4]
+    block = int(radius)
+    pixels = np.asarray(blur_numpy(source, 5, res, mode="pixelate"))
+    first = pixels[100 : 100 + block, 100 : 100 + block].reshape(-1, 3)
+    assert (first == first[0]).all()
+    assert (pixels[100, 100] != pixels[100, 100 + block]).any()
+
+
+def test_redaction_pool_saves_the_same_images(tmp_path):
+    args = argparse.Namespace(
+        blur_engine="pil",
+        blur_mode="gaussian",
+        ignore_no_bb=False,
+        ignore_regexp=None,
+        show_boxes=False,
+        save_blurred=True,
+    )
+    (tmp_path / "serial").mkdir()
+    (tmp_path / "pool").mkdir()
+    pool = RedactionPool(2)
+    for i in range(5):
+        source = image()
+        redact(tmp_path / "serial" / f"{i}.png", source.copy(), API_RES, args)
+        pool.submit(tmp_path / "pool" / f"{i}.png", source, API_RES, args)
+    pool.close()
+    for i in range(5):
+        serial = (tmp_path / "serial" / f"{i}_blurred.png").read_bytes()
+        assert (tmp_path / "pool" / f"{i}_blurred.png").read_bytes() == serial
+
+
+@requires_numpy
+def test_tile_boxes_cover_the_image():
+    covered = np.zeros((1000, 2100), dtype=bool)
+    for xmin, ymin, xmax, ymax in tile_boxes(2100, 1000, 512, 64):
+        assert xmax - xmin <= 512 and ymax - ymin <= 512
+        covered[ymin:ymax, xmin:xmax] = True
+    assert covered.all()
+    assert list(tile_boxes(300, 200, 512, 64)) == [(0, 0, 300, 200)]
+
+
+def large_image(tmp_path):
+    im = Image.new("RGB", (4000, 3000))
+    ImageDraw.Draw(im).rectangle((2000, 1500, 2399, 1619), fill=(255, 255, 255))
+    path = tmp_path / "large.jpg"
+    im.save(path, quality=95)
+    return path
+
+
+def test_open_reduced_decodes_jpeg_at_reduced_size(tmp_path):
+    path = large_image(tmp_path)
+    im, size = open_reduced(path, max_memory=16)
+    assert size == (4000, 3000)
+    assert im.size == (1000, 750)
+    assert im.width * im.height * 4 <= 16 * 1024**2 / 4
+
+
+@requires_numpy
+def test_detect_tiles_returns_full_resolution_boxes(tmp_path):
+    def recognition_api(fp, *args, **kwargs):
+        bbox = Image.open(fp).convert("L").point(lambda v: 255 * (v > 128)).getbbox()
+        if not bbox:
+            return dict(results=[])
+        box = dict(xmin=bbox[0], ymin=bbox[1], xmax=bbox[2], ymax=bbox[3])
+        return dict(results=[dict(box=box, vehicle=dict(score=0.0))])
+
+    args = argparse.Namespace(
+        max_memory=16,
+        tile_size=512,
+        detection_threshold=0.2,
+        ocr_threshold=0.5,
+        regions=None,
+        api_key=None,
+        sdk_url=None,
+    )
+    with mock.patch("number_plate_redaction.recognition_api", recognition_api):
+        size, predictions = detect_tiles(large_image(tmp_path), args)
+    assert size == (4000, 3000)
+    assert len(predictions) == 1 + 6  # Thumbnail and 3x2 tiles
+    boxes = []
+    for prediction in predictions:
+        for result in prediction["prediction"]["results"]:
+            b = result["box"]
+            boxes.append(
+                (
+                    b["xmin"] + prediction["x"],
+                    b["ymin"] + prediction["y"],
+                    b["xmax"] + prediction["x"],
+                    b["ymax"] + prediction["y"],
+                )
+            )
+    # Tiles may see part of the plate only
+    target = np.array((2000, 1500, 2400, 1620))
+    assert any(np.allclose(box, target, atol=12) for box in boxes)
+    for xmin, ymin, xmax, ymax in boxes:
+        assert xmin >= 2000 - 12 and ymin >= 1500 - 12
+        assert xmax <= 2400 + 12 and ymax <= 1620 + 12
+
+
+def test_detections_are_cached_next_to_the_image(tmp_path):
+    path = tmp_path / "car.jpg"
+    image().save(path)
+    args = argparse.Namespace(
+        cache_detections=True,
+        max_memory=None,
+        split_image=False,
+        detection_threshold=0.2,
+        ocr_threshold=0.5,
+        regions=None,
+        api_key=None,
+        sdk_url=None,
+    )
+
+    def api_res(*args, **kwargs):
+        plate = result("abc123", 100, 100, 220, 140)
+        plate["vehicle"]["box"] = dict(xmin=50, ymin=20, xmax=300, ymax=200)
+        plate["score"] = 0.9
+        return dict(results=[plate])
+
+    with mock.patch("number_plate_redaction.recognition_api") as recognition_api:
+        recognition_api.side_effect = api_res
+        source_im, first = detect(path, args)
+        assert source_im.size == (640, 480)
+        assert recognition_api.call_count == 1
+        assert (tmp_path / f"car.jpg{SIDECAR_SUFFIX}").exists()
+
+        source_im, second = detect(path, args)
+        assert source_im is None
+        assert second == first
+        assert recognition_api.call_count == 1
+
+        args.ocr_threshold = 0.6
+        detect(path, args)
+        assert recognition_api.call_count == 2
+
+        args.sdk_url = ["http://localhost:8080"]
+        detect(path, args)
+        assert recognition_api.call_count == 3
+
+        # Read-only directory
+        with mock.patch("tempfile.NamedTemporaryFile", side_effect=PermissionError):
+            args.ocr_threshold = 0.7
+            assert detect(path, args)[1]["results"]
+        assert recognition_api.call_count == 4
+
+        # A corrupt sidecar is a cache miss
+        sidecar = tmp_path / f"car.jpg{SIDECAR_SUFFIX}"
+        sidecar.write_text('{"key": "')
+        assert detect(path, args)[1] == first
+        assert recognition_api.call_count == 5
+        assert json.loads(sidecar.read_text())["results"] == first
+
+
+def test_images_above_max_memory_are_rejected(tmp_path):
+    path = large_image(tmp_path)
+    limit = Image.MAX_IMAGE_PIXELS
+    args = argparse.Namespace(max_memory=16, save_blurred=True, show_boxes=False)
+    with mock.patch("number_plate_redaction.recognition_api") as recognition_api:
+        with pytest.raises(ValueError, match="rejected"):
+            detect(path, args)
+    assert not recognition_api.called
+    assert open_full(path, max_memory=64).size == (4000, 3000)
+    assert Image.MAX_IMAGE_PIXELS == limit
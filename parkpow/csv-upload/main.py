@@ -3,6 +3,7 @@ import ast
 import base64
 import csv
 import datetime
+import email.utils
 import json
 import logging
 import os
@@ -28,6 +29,23 @@ STREAM_DIR = Path(os.environ.get("STREAM_DIR", "/user-data/"))
 CAMERA_TOKEN = "$(camera)"
 
 
+def retry_after(response, default=1.0):
+    """Seconds to wait before retrying a call throttled with a 429."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # Retry-After may also be an HTTP date
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
 class ParkPowApi:
     def __init__(self, token, sdk_url=None):
         if token is None:
@@ -49,7 +67,7 @@ class ParkPowApi:
                 lgr.debug(f"response: {response}")
                 if response.status_code < 200 or response.status_code > 300:
                     if response.status_code == 429:
-                        time.sleep(1)
+                        time.sleep(retry_after(response))
                     else:
                         logging.error(response.text)
                         raise Exception("Error logging vehicle")
@@ -83,7 +101,7 @@ class ParkPowApi:
             lgr.debug(f"Response : {response}")
             if response.status_code < 200 or response.status_code > 300:
                 if response.status_code == 429:
-                    time.sleep(1)
+                    time.sleep(retry_after(response))
                 else:
                     lgr.error(response.text)
                     raise Exception(f"Error logging vehicle: {response}")
@@ -1,18 +1,26 @@
 #!/usr/bin/env python
 
 import argparse
-import csv
+import contextlib
+import hashlib
 import io
+import itertools
 import json
 import math
+import os
+import sqlite3
 import sys
+import tempfile
+import textwrap
+import threading
 import time
-from collections import OrderedDict
-from itertools import combinations
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from fnmatch import fnmatch
+from functools import lru_cache
 from pathlib import Path
 
-import requests
-from PIL import Image, ImageDraw, ImageFont
+from metrics import enable_metrics, get_metrics, observe, timed
 
 if sys.version_info.major == 3 and sys.version_info.minor >= 10:
     from collections.abc import MutableMapping
@@ -30,7 +38,9 @@ Process images from a folder:
 Use the Snapshot SDK instead of the Cloud Api:
   python plate_recognition.py -s http://localhost:8080 /path/to/vehicle-*.jpg
 Specify Camera ID and/or two Regions:
-  plate_recognition.py -a MY_API_KEY --camera-id Camera1 -r us-ca -r th-37 /path/to/vehicle-*.jpg""",
+  plate_recognition.py -a MY_API_KEY --camera-id Camera1 -r us-ca -r th-37 /path/to/vehicle-*.jpg
+Process all the JPEG images of a folder and its sub-folders:
+  plate_recognition.py -a MY_API_KEY --input-dir /path/to/folder --include '*.jpg'""",
         formatter_class=argparse.RawTextHelpFormatter,
     )
     parser.add_argument("-a", "--api-key", help="Your API key.", required=False)
@@ -44,25 +54,120 @@ Specify Camera ID and/or two Regions:
     parser.add_argument(
         "-s",
         "--sdk-url",
-        help="Url to self hosted sdk  For example, http://localhost:8080",
+        help="Url to self hosted sdk  For example, http://localhost:8080. "
+        "Repeat to spread the calls over several SDK instances.",
         required=False,
+        action="append",
     )
     parser.add_argument(
         "--camera-id", help="Name of the source camera.", required=False
     )
-    parser.add_argument("files", nargs="+", type=Path, help="Path to vehicle images")
+    parser.add_argument("files", nargs="*", type=Path, help="Path to vehicle images")
+    parser.add_argument(
+        "--input-dir",
+        type=Path,
+        action="append",
+        help="Process the images of a folder and its sub-folders.",
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        help="Only process files of --input-dir matching this pattern, for example '*.jpg'.",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        help="Skip files and sub-folders of --input-dir matching this pattern.",
+    )
+    parser.add_argument(
+        "--from-list",
+        type=Path,
+        help="Process the images listed in a file, one path per line. Use - to read from stdin.",
+    )
     args_hook(parser)
     args = parser.parse_args()
+    if not args.files and not args.input_dir and not args.from_list:
+        parser.error("the following arguments are required: files")
     if not args.sdk_url and not args.api_key:
         raise Exception("api-key is required")
     return args
 
 
-_session = None
+def _matches(path, name, patterns):
+    return any(fnmatch(name, pattern) or fnmatch(path, pattern) for pattern in patterns)
 
 
-def recognition_api(
-    fp,
+def scan_dir(directory, include=None, exclude=None):
+    """
+    Yield the files of directory and its sub-folders as they are found.
+
+    :param include: glob patterns, files matching none of them are skipped
+    :param exclude: glob patterns of files and folders to skip
+    """
+    directories = [directory]
+    while directories:
+        current = directories.pop()
+        try:
+            entries = os.scandir(current)
+        except OSError as e:
+            print(e, file=sys.stderr)
+            continue
+        with entries:
+            for entry in entries:
+                if exclude and _matches(entry.path, entry.name, exclude):
+                    continue
+                try:
+                    # Like os.walk, symlinks to folders are not followed
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    is_file = not is_dir and entry.is_file()
+                except OSError as e:
+                    print(e, file=sys.stderr)
+                    continue
+                if is_dir:
+                    directories.append(entry.path)
+                elif is_file and (
+                    not include or _matches(entry.path, entry.name, include)
+                ):
+                    yield Path(entry.path)
+
+
+def iter_files(args):
+    """
+    Lazily yield the files given on the command line, in --from-list and in --input-dir.
+    """
+    for path in args.files:
+        yield path
+    if args.from_list:
+        if str(args.from_list) == "-":
+            list_file = contextlib.nullcontext(sys.stdin)  # Leave stdin open
+        else:
+            list_file = open(args.from_list)
+        with list_file as fp:
+            for line in fp:
+                if line.strip():
+                    yield Path(line.strip())
+    for directory in args.input_dir or []:
+        yield from scan_dir(directory, args.include, args.exclude)
+
+
+def _ordered_loads(text):
+    return json.loads(text, object_pairs_hook=OrderedDict)
+
+
+def _orjson_loads(text):
+    import orjson
+
+    return orjson.loads(text)
+
+
+JSON_DECODERS = {"ordered": _ordered_loads, "dict": json.loads, "orjson": _orjson_loads}
+
+
+CLOUD_API_URL = "https://api.platerecognizer.com/v1/plate-reader/"
+CONTAINER_API_URL = "https://container-api.parkpow.com/api/v1/predict/"
+
+
+def build_request(
     regions=None,
     api_key=None,
     sdk_url=None,
@@ -70,13 +175,14 @@ def recognition_api(
     camera_id=None,
     timestamp=None,
     mmc=None,
-    exit_on_error=True,
 ):
+    """
+    Return the url, upload field name, form data and headers of a recognition call.
+    """
     if regions is None:
         regions = []
     if config is None:
         config = {}
-    global _session
     data = dict(regions=regions, config=json.dumps(config))
     if camera_id:
         data["camera_id"] = camera_id
@@ -84,44 +190,749 @@ def recognition_api(
         data["mmc"] = mmc
     if timestamp:
         data["timestamp"] = timestamp
-    response = None
+    headers = {}
+    if api_key:
+        headers["Authorization"] = "Token " + api_key
+    if sdk_url and "container-api" in sdk_url:
+        return CONTAINER_API_URL, "image", None, headers
     if sdk_url:
-        fp.seek(0)
-        if "container-api" in sdk_url:
-            response = requests.post(
-                "https://container-api.parkpow.com/api/v1/predict/",
-                files=dict(image=fp),
-                headers={
-                    "Authorization": "Token " + api_key,
-                },
-            )
-        else:
-            response = requests.post(
-                sdk_url + "/v1/plate-reader/", files=dict(upload=fp), data=data
+        return sdk_url + "/v1/plate-reader/", "upload", data, {}
+    return CLOUD_API_URL, "upload", data, headers
+
+
+def reuse_response(api_res, fp, camera_id=None, timestamp=None):
+    """
+    Replace the fields describing the request in a response reused for fp.
+
+    The filename, time and camera of the first upload would be wrong, no time
+    was spent on the server.
+    """
+    from datetime import datetime, timezone
+
+    if timestamp is None:
+        now = datetime.now(timezone.utc)
+        timestamp = (
+            now.strftime("%Y-%m-%dT%H:%M:%S.") + f"{now.microsecond // 1000:03d}Z"
+        )
+    api_res["filename"] = os.path.basename(str(getattr(fp, "name", "image.jpg")))
+    api_res["timestamp"] = timestamp
+    api_res["camera_id"] = camera_id
+    if "processing_time" in api_res:
+        api_res["processing_time"] = 0.0
+    return api_res
+
+
+class ResultCache:
+    """
+    On-disk cache of recognition results stored in SQLite.
+
+    Entries are keyed by the hash of the image bytes and of the parameters that
+    change the prediction. The least recently used entries are evicted once the
+    cache grows beyond max_size bytes. Access times of hits are saved in
+    batches, with the next write or every touch_batch hits.
+    """
+
+    def __init__(self, cache_dir, max_size=1024**3, touch_batch=100):
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.touch_batch = touch_batch
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            str(cache_dir / "results.sqlite3"), check_same_thread=False
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results "
+            "(key TEXT PRIMARY KEY, value TEXT, size INTEGER, accessed REAL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)"
+        )
+        self._db.commit()
+        self._size = self._total_size()
+
+    def _total_size(self):
+        return self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()[0]
+
+    @staticmethod
+    def make_key(image, regions=None, config=None, mmc=None, camera_id=None):
+        params = json.dumps([regions or [], config or {}, mmc, camera_id])
+        digest = hashlib.sha256(image)
+        digest.update(params.encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[key] = time.time()
+            if self.hits % self.touch_batch == 0:
+                self._save_touched()
+                self._db.commit()
+            return row[0]
+
+    def _save_touched(self):
+        self._db.executemany(
+            "UPDATE results SET accessed = ? WHERE key = ?",
+            [(accessed, key) for key, accessed in self._touched.items()],
+        )
+        self._touched.clear()
+
+    def set(self, key, value):
+        size = len(value)
+        with self._lock:
+            self._save_touched()
+            previous = self._db.execute(
+                "SELECT size FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if previous:
+                self._size -= previous[0]
+            self._db.execute(
+                "REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
             )
-    else:
-        if not _session:
-            _session = requests.Session()
-            _session.headers.update({"Authorization": "Token " + api_key})
-        for _ in range(3):
+            self._size += size
+            recounted = False
+            while self._size > self.max_size:
+                row = self._db.execute(
+                    "SELECT key, size FROM results ORDER BY accessed LIMIT 1"
+                ).fetchone()
+                if (row is None or row[0] == key) and not recounted:
+                    # The size is stale if a process sharing the cache removed entries
+                    self._size = self._total_size()
+                    recounted = True
+                    continue
+                if row is None:
+                    break
+                self._db.execute("DELETE FROM results WHERE key = ?", (row[0],))
+                self._size -= row[1]
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._save_touched()
+            self._db.commit()
+            self._db.close()
+
+
+def parse_retry_after(value, default=1.0):
+    """Return the number of seconds requested by a Retry-After header."""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    import email.utils
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all the threads calling the API.
+
+    The rate starts at max_rate calls per second. It is halved when the API
+    answers 429 and grows back by max_rate / 100 after each successful call.
+    A Retry-After header pauses every caller for the requested time. Without
+    max_rate, calls are only paused after a 429.
+    """
+
+    def __init__(self, max_rate=None, min_rate=0.1, burst=1):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.throttled_calls = 0
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a call may be made."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            if self.rate:
+                elapsed = now - self._updated
+                self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+                self._tokens -= 1
+                wait = max(wait, -self._tokens / self.rate)
+            self._updated = now
+        if wait > 0:
+            time.sleep(wait)
+
+    def success(self):
+        with self._lock:
+            if self.rate and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+    def throttled(self, retry_after=None):
+        """Slow down after a 429 response."""
+        with self._lock:
+            self.throttled_calls += 1
+            now = time.monotonic()
+            if self.rate:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self._tokens = min(self._tokens, 0)
+            if retry_after is not None or not self.rate:
+                pause = 1.0 if retry_after is None else retry_after
+                self._paused_until = max(self._paused_until, now + pause)
+
+
+class Endpoint:
+    """State and statistics of one SDK instance."""
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+        self.failures = 0  # Consecutive errors
+        self.ejected_until = 0.0
+        self.total_time = 0.0
+
+
+class EndpointPool:
+    """
+    Spread calls over several SDK instances.
+
+    Each call goes to the healthy endpoint with the fewest outstanding
+    requests. An endpoint is ejected after max_failures consecutive errors.
+    Once cooldown seconds have passed, it gets a single probe request and
+    rejoins the pool if that request succeeds.
+    """
+
+    def __init__(self, urls, max_failures=3, cooldown=30.0):
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def acquire(self, exclude=None):
+        """
+        Pick an endpoint for the next call. Call release() when it is done.
+
+        :param exclude: endpoint to avoid, None is returned if it is the only
+            healthy one
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [
+                e for e in self.endpoints if e.ejected_until <= now and e is not exclude
+            ]
+            if not candidates and exclude is not None:
+                return None
+            if not candidates:
+                # Everything is ejected, try the endpoint that recovers first
+                candidates = [min(self.endpoints, key=lambda e: e.ejected_until)]
+            endpoint = min(candidates, key=lambda e: (e.outstanding, e.requests))
+            if endpoint.failures >= self.max_failures:
+                # Probe, other calls keep avoiding it until the probe succeeds
+                endpoint.ejected_until = now + self.cooldown
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint, ok, duration=0.0):
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.total_time += duration
+            if ok:
+                endpoint.failures = 0
+                endpoint.ejected_until = 0.0
+                return
+            endpoint.errors += 1
+            endpoint.failures += 1
+            if endpoint.failures >= self.max_failures:
+                if endpoint.failures == self.max_failures:
+                    endpoint.ejections += 1
+                endpoint.ejected_until = time.monotonic() + self.cooldown
+
+    def summary(self):
+        """Markdown table of the calls made to each endpoint."""
+        lines = [
+            "| Endpoint                       | Requests | Errors   | Ejections | Mean ms | Status  |",
+            "| ------------------------------ | -------- | -------- | --------- | ------- | ------- |",
+        ]
+        now = time.monotonic()
+        with self._lock:
+            for e in self.endpoints:
+                mean = e.total_time / e.requests * 1000 if e.requests else 0.0
+                status = "ejected" if e.ejected_until > now else "up"
+                lines.append(
+                    f"| {e.url:30s} | {e.requests:8d} | {e.errors:8d} "
+                    f"| {e.ejections:9d} | {mean:7.1f} | {status:7s} |"
+                )
+        return "\n".join(lines)
+
+
+class RecognitionClient:
+    """
+    Send images to the Cloud API, a Snapshot SDK or the container API.
+
+    All threads share one pool of keep-alive connections. Each thread gets its
+    own requests.Session mounted on that pool since sessions are not
+    thread-safe. When a ResultCache is given, cached results are returned
+    without calling the API. Calls are paced by a RateLimiter shared by all
+    threads. When sdk_url is a list, calls are spread by an EndpointPool and
+    failed calls are retried on another endpoint.
+
+    With hedge_percentile, a call to a list of endpoints that has not returned
+    within that percentile of the recent latencies is duplicated to another
+    endpoint. The first response wins, the other one is discarded.
+
+    When a DuplicateFilter is given, an image that is nearly identical to a
+    recent image of the same camera gets the result of that image.
+
+    Responses are decoded by json_decoder, one of JSON_DECODERS. "dict" and
+    "orjson" (requires orjson) are faster than the default "ordered" and keep
+    the same key order since dicts preserve insertion order.
+    """
+
+    def __init__(
+        self,
+        pool_size=10,
+        cache=None,
+        rate_limiter=None,
+        retries=3,
+        hedge_percentile=None,
+        json_decoder="ordered",
+        duplicates=None,
+    ):
+        from requests.adapters import HTTPAdapter
+
+        self.pool_size = pool_size
+        self.cache = cache
+        self.duplicates = duplicates
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.retries = retries
+        self.hedge_percentile = hedge_percentile
+        self.loads = JSON_DECODERS[json_decoder]
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._local = threading.local()
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+        self._latencies = deque(maxlen=200)
+        self._hedge_lock = threading.Lock()
+        self._hedge_executor = None
+
+    def get_pool(self, sdk_url):
+        """Return the EndpointPool of sdk_url, a url or a list of urls."""
+        if not sdk_url:
+            return None
+        urls = (sdk_url,) if isinstance(sdk_url, str) else tuple(sdk_url)
+        with self._pools_lock:
+            pool = self._pools.get(urls)
+            if pool is None:
+                pool = self._pools[urls] = EndpointPool(urls)
+            return pool
+
+    @property
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import requests
+
+            session = requests.Session()
+            session.mount("http://", self._adapter)
+            session.mount("https://", self._adapter)
+            self._local.session = session
+        return session
+
+    def close(self):
+        if self._hedge_executor:
+            if sys.version_info >= (3, 9):
+                self._hedge_executor.shutdown(wait=False, cancel_futures=True)
+            else:
+                self._hedge_executor.shutdown(wait=False)
+        self._adapter.close()
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, None until enough calls were timed."""
+        with self._hedge_lock:
+            if len(self._latencies) < 20:
+                return None
+            latencies = sorted(self._latencies)
+        index = int(len(latencies) * self.hedge_percentile / 100)
+        return latencies[min(index, len(latencies) - 1)]
+
+    def _post(self, pool, endpoint, upload, params):
+        url, file_field, data, headers = build_request(
+            params["regions"],
+            params["api_key"],
+            endpoint.url if endpoint else None,
+            params["config"],
+            params["camera_id"],
+            params["timestamp"],
+            params["mmc"],
+        )
+        start = time.perf_counter()
+        try:
+            with timed("network", url):
+                response = self.session.post(
+                    url, files={file_field: upload}, data=data, headers=headers
+                )
+        except Exception:
+            if endpoint:
+                pool.release(endpoint, False, time.perf_counter() - start)
+            raise
+        duration = time.perf_counter() - start
+        if endpoint:
+            pool.release(endpoint, response.status_code < 500, duration)
+        if self.hedge_percentile and response.status_code < 500:
+            with self._hedge_lock:
+                self._latencies.append(duration)
+        return url, response
+
+    def _hedged_post(self, pool, upload, params):
+        with self._hedge_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(self.pool_size * 2)
+        executor = self._hedge_executor
+        primary = pool.acquire()
+        futures = [executor.submit(self._post, pool, primary, upload, params)]
+        delay = self.hedge_delay()
+        if delay is not None and not wait(futures, timeout=delay).done:
+            backup = pool.acquire(exclude=primary)
+            if backup is not None:
+                # The backup is a second call and counts against the rate limit
+                self.rate_limiter.acquire()
+                with self._hedge_lock:
+                    self.hedges += 1
+                futures.append(
+                    executor.submit(self._post, pool, backup, upload, params)
+                )
+        error = None
+        fallback = None
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                error = e
+                continue
+            if not 200 <= result[1].status_code < 300:
+                # A quick error must not beat a slower success
+                fallback = fallback or result
+                continue
+            for other in futures:
+                other.cancel()  # The losing request completes in the background
+            if future is not futures[0]:
+                with self._hedge_lock:
+                    self.hedge_wins += 1
+            return result
+        if fallback:
+            return fallback
+        raise error
+
+    def recognize(
+        self,
+        fp,
+        regions=None,
+        api_key=None,
+        sdk_url=None,
+        config=None,
+        camera_id=None,
+        timestamp=None,
+        mmc=None,
+        exit_on_error=True,
+    ):
+        import requests
+
+        params = dict(
+            regions=regions,
+            api_key=api_key,
+            config=config,
+            camera_id=camera_id,
+            timestamp=timestamp,
+            mmc=mmc,
+        )
+        cache_key = None
+        if self.cache:
             fp.seek(0)
-            response = _session.post(
-                "https://api.platerecognizer.com/v1/plate-reader/",
-                files=dict(upload=fp),
-                data=data,
-            )
+            cache_key = self.cache.make_key(fp.read(), regions, config, mmc, camera_id)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return reuse_response(self.loads(cached), fp, camera_id, timestamp)
+        image_hash = None
+        if self.duplicates:
+            from duplicates import dhash
+
+            fp.seek(0)
+            with timed("hash"):
+                image_hash = dhash(fp)
+            previous = self.duplicates.get(camera_id, image_hash)
+            if previous is not None:
+                api_res = self.loads(previous)
+                duplicate_of = api_res.get("filename")
+                reuse_response(api_res, fp, camera_id, timestamp)
+                api_res["duplicate_of"] = duplicate_of
+                return api_res
+        pool = self.get_pool(sdk_url)
+        failover = pool is not None and len(pool) > 1
+        hedge = failover and self.hedge_percentile
+        if hedge:
+            # Both copies of a hedged call need their own readable upload
+            fp.seek(0)
+            upload = (os.path.basename(getattr(fp, "name", "image.jpg")), fp.read())
+        response = None
+        for attempt in range(self.retries):
+            self.rate_limiter.acquire()
+            try:
+                if hedge:
+                    url, response = self._hedged_post(pool, upload, params)
+                else:
+                    fp.seek(0)
+                    endpoint = pool.acquire() if pool else None
+                    url, response = self._post(pool, endpoint, fp, params)
+            except requests.RequestException:
+                if failover and attempt + 1 < self.retries:
+                    continue
+                raise
             if response.status_code == 429:  # Max calls per second reached
-                time.sleep(1)
+                retry_after = response.headers.get("Retry-After")
+                self.rate_limiter.throttled(
+                    parse_retry_after(retry_after) if retry_after else None
+                )
+            elif failover and response.status_code >= 500:
+                continue  # Try another endpoint
             else:
+                self.rate_limiter.success()
                 break
 
-    if response is None:
-        return {}
-    if response.status_code < 200 or response.status_code > 300:
-        print(response.text)
+        if response is None:
+            return {}
+        if response.status_code < 200 or response.status_code > 300:
+            print(response.text)
+            if exit_on_error:
+                exit(1)
+        else:
+            if cache_key:
+                self.cache.set(cache_key, response.text)
+            if image_hash is not None:
+                self.duplicates.add(camera_id, image_hash, response.content)
+        with timed("parse", url):
+            api_res = self.loads(response.content)
+        if "processing_time" in api_res:
+            observe("server", api_res["processing_time"] / 1000, url)
+        return api_res
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the RecognitionClient shared by recognition_api calls."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = RecognitionClient()
+        return _client
+
+
+def set_client(client):
+    """Replace the RecognitionClient shared by recognition_api calls."""
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def recognition_api(
+    fp,
+    regions=None,
+    api_key=None,
+    sdk_url=None,
+    config=None,
+    camera_id=None,
+    timestamp=None,
+    mmc=None,
+    exit_on_error=True,
+):
+    return get_client().recognize(
+        fp,
+        regions,
+        api_key,
+        sdk_url,
+        config=config,
+        camera_id=camera_id,
+        timestamp=timestamp,
+        mmc=mmc,
+        exit_on_error=exit_on_error,
+    )
+
+
+async def recognition_api_async(
+    fp,
+    regions=None,
+    api_key=None,
+    sdk_url=None,
+    config=None,
+    camera_id=None,
+    timestamp=None,
+    mmc=None,
+    exit_on_error=True,
+    session=None,
+    filename=None,
+):
+    """
+    Asyncio version of recognition_api. Requires aiohttp.
+
+    :param fp: file object or bytes of the image
+    :param session: aiohttp.ClientSession to reuse, a new one is created otherwise
+    :param filename: name of the upload, defaults to the name of fp
+    """
+    import asyncio
+
+    import aiohttp
+
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await recognition_api_async(
+                fp,
+                regions,
+                api_key,
+                sdk_url,
+                config=config,
+                camera_id=camera_id,
+                timestamp=timestamp,
+                mmc=mmc,
+                exit_on_error=exit_on_error,
+                session=session,
+                filename=filename,
+            )
+
+    if filename is None:
+        filename = os.path.basename(getattr(fp, "name", "image.jpg"))
+    if isinstance(fp, bytes):
+        image = fp
+    else:
+        fp.seek(0)
+        image = await asyncio.get_running_loop().run_in_executor(None, fp.read)
+
+    pool = get_client().get_pool(sdk_url)
+    for _ in range(3):
+        endpoint = pool.acquire() if pool else None
+        url, file_field, data, headers = build_request(
+            regions,
+            api_key,
+            endpoint.url if endpoint else None,
+            config,
+            camera_id,
+            timestamp,
+            mmc,
+        )
+        form = aiohttp.FormData()
+        for key, value in (data or {}).items():
+            for item in value if isinstance(value, list) else [value]:
+                form.add_field(key, str(item))
+        form.add_field(file_field, image, filename=filename)
+        start = time.perf_counter()
+        try:
+            async with session.post(url, data=form, headers=headers) as response:
+                status = response.status
+                text = await response.text()
+                retry_after = response.headers.get("Retry-After")
+        except aiohttp.ClientError:
+            if endpoint:
+                pool.release(endpoint, False, time.perf_counter() - start)
+            raise
+        if endpoint:
+            pool.release(endpoint, status < 500, time.perf_counter() - start)
+        if status == 429:  # Max calls per second reached
+            await asyncio.sleep(parse_retry_after(retry_after))
+        else:
+            break
+
+    if status < 200 or status > 300:
+        print(text)
         if exit_on_error:
             exit(1)
-    return response.json(object_pairs_hook=OrderedDict)
+    return get_client().loads(text)
+
+
+async def recognize_files_async(paths, concurrency=50, pool_size=None, **kwargs):
+    """
+    Send all paths to recognition_api_async on the running event loop.
+
+    Paths are read from the iterable as workers become free, so a generator
+    over a large directory is never loaded in memory at once. Files are read
+    in the default executor to keep the event loop responsive.
+
+    :param paths: image paths
+    :param concurrency: maximum number of uploads in flight
+    :param pool_size: maximum number of open connections, defaults to concurrency
+    :param kwargs: forwarded to recognition_api_async
+    :return: list of results in the order of paths
+    """
+    import asyncio
+
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(concurrency)
+    results = []
+    errors = []
+    connector = aiohttp.TCPConnector(limit=pool_size or concurrency)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                if errors:
+                    continue  # Keep draining so that the producer is not blocked
+                index, path = item
+                try:
+                    image = await loop.run_in_executor(None, Path(path).read_bytes)
+                    results[index] = await recognition_api_async(
+                        image,
+                        session=session,
+                        filename=os.path.basename(path),
+                        **kwargs,
+                    )
+                except Exception as e:
+                    errors.append(e)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+        try:
+            for index, path in enumerate(paths):
+                if errors:
+                    break
+                results.append(None)
+                await queue.put((index, path))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+    if errors:
+        raise errors[0]
+    return results
 
 
 def flatten_dict(d, parent_key="", sep="_"):
@@ -151,10 +962,115 @@ def flatten(result):
     return flattened_data
 
 
-def save_cropped(api_res, path, args):
+class SourceImage:
+    """
+    Image file decoded at most once and shared by the steps processing it.
+
+    The file is opened when the header is first needed and pixels are only
+    decoded when image is first used. Call close() or use it as a context
+    manager to release the file and the pixels.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = None
+        self._image = None
+        self._size = None
+        self._exif = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for im in (self._file, self._image):
+            if im is not None:
+                im.close()
+        self._file = self._image = None
+
+    def _open(self):
+        if self._file is None:
+            from PIL import Image
+
+            self._file = Image.open(self.path)
+            if self._size is None:
+                self._size = self._file.size
+                self._exif = self._file.info.get("exif")
+        return self._file
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._open()
+        return self._size
+
+    @property
+    def exif(self):
+        if self._size is None:
+            self._open()
+        return self._exif
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    @property
+    def decoded(self):
+        return self._image is not None
+
+    @property
+    def image(self):
+        """Full resolution RGB image."""
+        if self._image is None:
+            with timed("decode"):
+                im = self._open()
+                if im.mode != "RGB":
+                    im = im.convert("RGB")
+                    self._file.close()
+                im.load()
+            self._image = im
+            self._file = None
+        return self._image
+
+    def thumbnail(self, max_dimension):
+        """
+        Return an RGB copy whose largest side is at most max_dimension.
+
+        JPEG files that were not decoded yet are decoded at a reduced size.
+        The file is then used up, image opens it again if it is needed later.
+        """
+        if self.decoded:
+            im = self._image.copy()
+        else:
+            im = self._open()
+            self._file = None
+        if max_dimension and max(im.size) > max_dimension:
+            im.thumbnail((max_dimension, max_dimension))
+        if im.mode != "RGB":
+            im = im.convert("RGB")
+        return im
+
+
+@lru_cache(maxsize=None)
+def load_font(size=10):
+    from PIL import ImageFont
+
+    font_path = Path("assets/DejaVuSansMono.ttf")
+    if font_path.exists():
+        return ImageFont.truetype(str(font_path), size)
+    return ImageFont.load_default()
+
+
+def save_cropped(api_res, path, args, source=None):
     dest = args.crop_lp or args.crop_vehicle
     dest.mkdir(exist_ok=True, parents=True)
-    image = Image.open(path).convert("RGB")
+    image = (source or SourceImage(path)).image
     for i, result in enumerate(api_res.get("results", []), 1):
         if args.crop_lp and result["plate"]:
             box = result["box"]
@@ -172,30 +1088,306 @@ def save_cropped(api_res, path, args):
             cropped.save(dest / filename)
 
 
+class ResultWriter:
+    """
+    Save results one at a time as they are produced.
+
+    The output file is only created when the first result is written and it is
+    flushed every batch_size results. Without a path, results go to stdout.
+    With append, results are added to an existing output file. on_flush is
+    called once the written results have been flushed to the output.
+    """
+
+    newline = None
+
+    def __init__(self, path=None, batch_size=100, append=False):
+        self.path = path
+        self.batch_size = batch_size
+        self.append = bool(
+            append and path and Path(path).exists() and Path(path).stat().st_size
+        )
+        self.count = 0
+        self.on_flush = None
+        self._fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def fp(self):
+        if self._fp is None:
+            if self.path:
+                mode = "a" if self.append else "w"
+                self._fp = open(self.path, mode, newline=self.newline)
+            else:
+                self._fp = sys.stdout
+            self.start()
+        return self._fp
+
+    @property
+    def position(self):
+        """Position in the output file after the last result written."""
+        return self.fp.tell() if self.path else None
+
+    @staticmethod
+    def truncate(path, position):
+        """Drop what was written to path after position."""
+        os.truncate(path, position)
+
+    def start(self):
+        pass
+
+    def write_result(self, result):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+    def flush(self):
+        self.fp.flush()
+        if self.on_flush:
+            self.on_flush()
+
+    def write(self, result):
+        self.write_result(result)
+        self.count += 1
+        if self.count % self.batch_size == 0:
+            self.flush()
+
+    def close(self):
+        if self._fp is None and (not self.path or self.append):
+            # Always print to stdout, and end a resumed file even without results
+            self.fp
+        if self._fp is None:
+            return
+        self.finish()
+        if self._fp is sys.stdout:
+            self._fp.flush()
+        else:
+            self._fp.close()
+        self._fp = None
+        if self.on_flush:
+            self.on_flush()
+
+
+class JsonWriter(ResultWriter):
+    """Same output as json.dump(results, fp, indent=indent)."""
+
+    def __init__(self, path=None, batch_size=100, indent=None, append=False):
+        super().__init__(path, batch_size, append)
+        self.indent = indent
+        # When appending, the file was truncated after the last result
+        self._empty = not self.append
+
+    def start(self):
+        if not self.append:
+            self._fp.write("[")
+
+    def write_result(self, result):
+        text = json.dumps(result, indent=self.indent)
+        if self.indent:
+            text = "\n" + textwrap.indent(text, " " * self.indent)
+        if not self._empty:
+            text = ("," if self.indent else ", ") + text
+        self._empty = False
+        self.fp.write(text)
+
+    def finish(self):
+        if self.indent:
+            self._fp.write("]\n" if self._empty else "\n]\n")
+        else:
+            self._fp.write("]")
+
+
+class JsonLinesWriter(ResultWriter):
+    """One JSON document per line."""
+
+    def write_result(self, result):
+        self.fp.write(json.dumps(result) + "\n")
+
+
+class CsvWriter(ResultWriter):
+    """
+    One row per plate.
+
+    Results may not all have the same fields, for example when only some of
+    them include model_make. Rows are written every batch_size results. When
+    a batch brings new columns, the rows already written are rewritten with
+    the new header. The position is the number of rows written.
+    """
+
+    newline = ""
+
+    def __init__(self, path=None, batch_size=100, append=False):
+        super().__init__(path, batch_size, append)
+        self.fieldnames = []
+        self.rows = 0
+        if self.append:
+            import csv
+
+            with open(self.path, newline="") as fp:
+                reader = csv.reader(fp)
+                self.fieldnames = next(reader, [])
+                self.rows = sum(1 for _ in reader)
+        self._written_fieldnames = list(self.fieldnames)
+        self._known_fieldnames = set(self.fieldnames)
+        self._pending = []
+
+    @property
+    def position(self):
+        return self.rows
+
+    @staticmethod
+    def truncate(path, position):
+        import csv
+
+        directory = Path(path).parent
+        with open(path, newline="") as src, tempfile.NamedTemporaryFile(
+            "w", dir=directory, newline="", delete=False
+        ) as dst:
+            reader = csv.reader(src)
+            writer = csv.writer(dst)
+            writer.writerow(next(reader, []))
+            for row in itertools.islice(reader, position):
+                writer.writerow(row)
+        os.replace(dst.name, path)
+
+    def _add_fieldnames(self, row):
+        # New columns are inserted after the column preceding them in the row
+        previous = None
+        for key in row:
+            if key not in self._known_fieldnames:
+                index = self.fieldnames.index(previous) + 1 if previous else 0
+                self.fieldnames.insert(index, key)
+                self._known_fieldnames.add(key)
+            previous = key
+
+    def start(self):
+        if not self.append:
+            import csv
+
+            csv.DictWriter(self._fp, fieldnames=self.fieldnames).writeheader()
+            self._written_fieldnames = list(self.fieldnames)
+
+    def write_result(self, result):
+        for row in flatten(result.copy()):  # Get flattened data for each plate
+            self._add_fieldnames(row)
+            self._pending.append(row)
+            self.rows += 1
+
+    def _add_columns_to_existing_rows(self):
+        import csv
+
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        directory = Path(self.path).parent
+        with open(self.path, newline="") as src, tempfile.NamedTemporaryFile(
+            "w", dir=directory, newline="", delete=False
+        ) as dst:
+            writer = csv.DictWriter(dst, fieldnames=self.fieldnames)
+            writer.writeheader()
+            writer.writerows(csv.DictReader(src))
+        os.replace(dst.name, self.path)
+        self.append = True
+        self._written_fieldnames = list(self.fieldnames)
+
+    def _write_pending(self):
+        import csv
+
+        if not self._pending:
+            return
+        header_written = self._fp is not None or self.append
+        if header_written and self.fieldnames != self._written_fieldnames:
+            self._add_columns_to_existing_rows()
+        writer = csv.DictWriter(self.fp, fieldnames=self.fieldnames)
+        writer.writerows(self._pending)
+        self._pending = []
+
+    def flush(self):
+        self._write_pending()
+        if self._fp is not None:
+            self._fp.flush()
+        if self.on_flush:
+            self.on_flush()
+
+    def close(self):
+        self._write_pending()
+        super().close()
+
+
+WRITERS = {"json": JsonWriter, "jsonl": JsonLinesWriter, "csv": CsvWriter}
+
+
+def open_writer(path=None, output_format="json", append=False):
+    """
+    Return a ResultWriter for path. Without a path, results are printed as JSON.
+    """
+    if not path:
+        return JsonWriter(indent=2)
+    return WRITERS[output_format](path, append=append)
+
+
+class Manifest:
+    """
+    Files already processed by a batch run, stored in SQLite.
+
+    A file is skipped when its size and modification time match its entry.
+    The offset of an entry is the position of the output writer after its
+    result. Entries should only be committed once the output is flushed.
+    """
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files "
+            "(path TEXT PRIMARY KEY, size INTEGER, mtime REAL, offset INTEGER)"
+        )
+        self._db.commit()
+
+    def count(self):
+        return self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    @staticmethod
+    def _stat(path):
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime
+
+    def is_done(self, path):
+        key, size, mtime = self._stat(path)
+        row = self._db.execute(
+            "SELECT size, mtime FROM files WHERE path = ?", (key,)
+        ).fetchone()
+        return row == (size, mtime)
+
+    def add(self, path, offset=None):
+        self._db.execute(
+            "REPLACE INTO files VALUES (?, ?, ?, ?)", self._stat(path) + (offset,)
+        )
+
+    def commit(self):
+        self._db.commit()
+
+    def output_offset(self):
+        """Position in the output file after the last committed result."""
+        return self._db.execute("SELECT MAX(offset) FROM files").fetchone()[0]
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+
 def save_results(results, args):
     path = args.output_file
     if not Path(path).parent.exists():
         print("%s does not exist" % path)
         return
-    if not results:
-        return
-    if args.format == "json":
-        with open(path, "w") as fp:
-            json.dump(results, fp)
-    elif args.format == "csv":
-        fieldnames = []
-        for result in results[:10]:
-            candidates = flatten(result.copy())
-            for candidate in candidates:
-                if len(fieldnames) < len(candidate):
-                    fieldnames = candidate.keys()
-        with open(path, "w") as fp:
-            writer = csv.DictWriter(fp, fieldnames=fieldnames)
-            writer.writeheader()
-            for result in results:
-                flattened_results = flatten(result)  # Get flattened data for each plate
-                for flattened_result in flattened_results:
-                    writer.writerow(flattened_result)
+    with open_writer(path, args.format) as writer:
+        for result in results:
+            writer.write(result)
 
 
 def custom_args(parser):
@@ -219,7 +1411,7 @@ Enable Make Model and Color prediction:
         "--format",
         help="Format of the result.",
         default="json",
-        choices="json csv".split(),
+        choices="json jsonl csv".split(),
     )
     parser.add_argument(
         "--mmc",
@@ -252,15 +1444,96 @@ Enable Make Model and Color prediction:
         default=10,
         help="Percentage of window overlap when splitting",
     )
+    parser.add_argument(
+        "--max-upload-dimension",
+        type=int,
+        help="Downscale images so that their largest side is at most this size before uploading. "
+        "With --split-image, each tile is downscaled. "
+        "Boxes are returned in the coordinates of the original image.",
+    )
+    parser.add_argument(
+        "--upload-quality",
+        type=int,
+        help="JPEG quality of the images re-encoded before uploading. Defaults to 95.",
+    )
+    parser.add_argument(
+        "--tile-workers",
+        type=int,
+        default=1,
+        help="Number of parts of a split image sent for recognition concurrently.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of images sent for recognition concurrently.",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        help="Maximum number of kept-alive connections. Defaults to workers * tile-workers.",
+    )
+    parser.add_argument(
+        "--max-calls-per-second",
+        type=float,
+        help="Maximum rate of API calls shared by all workers. It is lowered when the API answers 429.",
+    )
+    parser.add_argument(
+        "--json-decoder",
+        default="ordered",
+        choices=sorted(JSON_DECODERS),
+        help="Decoder of the API responses. dict and orjson (requires the orjson package) are faster.",
+    )
+    parser.add_argument(
+        "--hedge-percentile",
+        type=float,
+        help="With several --sdk-url, send a duplicate of a call to another instance when it is slower than this percentile of the recent calls, for example 95.",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        help="Record processed files in this file. When the run is restarted, they are skipped "
+        "and new results are appended to the output file.",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="Print the duration of each processing stage when done.",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Expose the duration of each processing stage on http://0.0.0.0:PORT/metrics (Prometheus format).",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        help="Reuse results of images already processed with the same parameters.",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=1024,
+        help="Maximum size of the result cache in MB.",
+    )
+    parser.add_argument(
+        "--dedup-threshold",
+        type=int,
+        help="Reuse the result of a recent image of the same camera when the perceptual hashes differ by at most this many bits (out of 64), for example 4.",
+    )
+    parser.add_argument(
+        "--dedup-window",
+        type=int,
+        default=20,
+        help="Number of recent images per camera compared with --dedup-threshold.",
+    )
 
 
 def draw_bb(im, data, new_size=(1920, 1050), text_func=None):
+    from PIL import ImageDraw
+
     draw = ImageDraw.Draw(im)
-    font_path = Path("assets/DejaVuSansMono.ttf")
-    if font_path.exists():
-        font = ImageFont.truetype(str(font_path), 10)
-    else:
-        font = ImageFont.load_default()
+    font = load_font()
     rect_color = (0, 255, 0)
     for result in data:
         b = result["box"]
@@ -301,94 +1574,39 @@ def text_function(result):
     return result["plate"]
 
 
-def bb_iou(a, b):
-    # determine the (x, y)-coordinates of the intersection rectangle
-    x_a = max(a["xmin"], b["xmin"])
-    y_a = max(a["ymin"], b["ymin"])
-    x_b = min(a["xmax"], b["xmax"])
-    y_b = min(a["ymax"], b["ymax"])
-
-    # compute the area of both the prediction and ground-truth
-    # rectangles
-    area_a = (a["xmax"] - a["xmin"]) * (a["ymax"] - a["ymin"])
-    area_b = (b["xmax"] - b["xmin"]) * (b["ymax"] - b["ymin"])
-
-    # compute the area of intersection rectangle
-    area_inter = max(0, x_b - x_a) * max(0, y_b - y_a)
-    return area_inter / float(max(area_a + area_b - area_inter, 1))
-
-
-def clean_objs(objects, threshold=0.1):
-    # Only keep the ones with best score or no overlap
-    for o1, o2 in combinations(objects, 2):
-        if (
-            "remove" in o1
-            or "remove" in o2
-            or bb_iou(o1["box"], o2["box"]) <= threshold
-        ):
-            continue
-        if o1["score"] > o2["score"]:
-            o2["remove"] = True
-        else:
-            o1["remove"] = True
-    return [x for x in objects if "remove" not in x]
-
-
-def merge_results(images):
-    result = dict(results=[])
-    for data in images:
-        for item in data["prediction"]["results"]:
-            result["results"].append(item)
-            for b in [item["box"], item["vehicle"].get("box", {})]:
-                b["ymin"] += data["y"]
-                b["xmin"] += data["x"]
-                b["ymax"] += data["y"]
-                b["xmax"] += data["x"]
-    result["results"] = clean_objs(result["results"])
-    return result
-
-
-def inside(a, b):
-    return (
-        a["xmin"] > b["xmin"]
-        and a["ymin"] > b["ymin"]
-        and a["xmax"] < b["xmax"]
-        and a["ymax"] < b["ymax"]
+def needs_image(args):
+    """True when output_image uses the decoded source image."""
+    return bool(
+        args.show_boxes or args.annotate_images or args.crop_lp or args.crop_vehicle
     )
 
 
-def post_processing(results):
-    new_list = []
-    for item in results["results"]:
-        if item["score"] < 0.2 and any(
-            [inside(x["box"], item["box"]) for x in results["results"] if x != item]
-        ):
-            continue
-        new_list.append(item)
-    results["results"] = new_list
-    return results
-
-
-def output_image(args, path, results):
+def output_image(args, path, results, source=None):
+    source = source or SourceImage(path)
+    crop = args.crop_lp or args.crop_vehicle
     if args.show_boxes or args.annotate_images and "results" in results:
-        image = Image.open(path)
+        # Boxes are drawn on a copy when the clean image is still needed for crops
+        image = source.image.copy() if crop else source.image
         annotated_image = draw_bb(image, results["results"], None, text_function)
         if args.show_boxes:
             annotated_image.show()
         if args.annotate_images:
             annotated_image.save(path.with_name(f"{path.stem}_annotated{path.suffix}"))
-    if args.crop_lp or args.crop_vehicle:
-        save_cropped(results, path, args)
+    if crop:
+        save_cropped(results, path, args, source)
 
 
-def process_split_image(path, args, engine_config):
+def process_split_image(path, args, engine_config, source=None):
     if args.split_x == 0 or args.split_y == 0:
         raise ValueError("Please specify --split-x or --split-y")
 
+    from PIL import ImageDraw
+
+    from bounding_boxes import merge_results, post_processing
+
     # Predictions
-    fp = Image.open(path)
-    if fp.mode != "RGB":
-        fp = fp.convert("RGB")
+    source = source or SourceImage(path)
+    fp = source.image
     images = [((0, 0), fp)]  # Entire image
 
     overlap_pct = args.split_overlap
@@ -438,10 +1656,21 @@ def process_split_image(path, args, engine_config):
     camera_ids = []
     timestamps = []
     processing_times = []
-    for (x, y), im in images:
+
+    def recognize_tile(image):
+        (x, y), im = image
+        scale = 1
         im_bytes = io.BytesIO()
-        im.save(im_bytes, "JPEG", quality=95)
+        with timed("encode"):
+            max_dimension = args.max_upload_dimension
+            if max_dimension and max(im.size) > max_dimension:
+                # The first tile is the source image itself, resize a copy
+                im = im.copy()
+                im.thumbnail((max_dimension, max_dimension))
+                scale = max(image[1].size) / max(im.size)
+            im.save(im_bytes, "JPEG", quality=args.upload_quality or 95)
         im_bytes.seek(0)
+        im_bytes.name = Path(path).name
         api_res = recognition_api(
             im_bytes,
             args.regions,
@@ -451,6 +1680,12 @@ def process_split_image(path, args, engine_config):
             camera_id=args.camera_id,
             mmc=args.mmc,
         )
+        if scale != 1:
+            scale_boxes(api_res, scale)
+        return x, y, api_res
+
+    # Tiles are processed concurrently but results are kept in tile order
+    for x, y, api_res in imap_bounded(recognize_tile, images, args.tile_workers):
         results.append(dict(prediction=api_res, x=x, y=y))
         if "usage" in api_res:
             usage.append(api_res["usage"])
@@ -461,7 +1696,8 @@ def process_split_image(path, args, engine_config):
     api_results["filename"] = Path(path).name
     api_results["timestamp"] = timestamps[len(timestamps) - 1]
     api_results["camera_id"] = camera_ids[len(camera_ids) - 1]
-    results = post_processing(merge_results(results))
+    with timed("post_processing"):
+        results = post_processing(merge_results(results))
     results = OrderedDict(list(api_results.items()) + list(results.items()))
     if len(usage):
         results["usage"] = usage[len(usage) - 1]
@@ -479,12 +1715,50 @@ def process_split_image(path, args, engine_config):
         b["xmax"] = b["xmax"] + padding_x
         b["ymax"] = b["ymax"] + padding_y
 
-    output_image(args, path, results)
+    with timed("output_image"):
+        output_image(args, path, results, source)
     return results
 
 
-def process_full_image(path, args, engine_config):
-    with open(path, "rb") as fp:
+def downscale_image(path, max_dimension=None, quality=95, source=None):
+    """
+    Resize the image so that its largest side is at most max_dimension and
+    encode it as JPEG.
+
+    :return: (JPEG bytes, ratio between the original and the resized largest side)
+    """
+    source = source or SourceImage(path)
+    with timed("encode"):
+        im = source.thumbnail(max_dimension)
+        im_bytes = io.BytesIO()
+        im.save(im_bytes, "JPEG", quality=quality, exif=source.exif or b"")
+    im_bytes.seek(0)
+    im_bytes.name = source.path.name
+    return im_bytes, max(source.size) / max(im.size)
+
+
+def scale_boxes(api_res, scale):
+    """Multiply the coordinates of plate and vehicle boxes by scale."""
+    for result in api_res.get("results", []):
+        for b in [result["box"], result.get("vehicle", {}).get("box", {})]:
+            for key in b:
+                b[key] = int(round(b[key] * scale))
+    return api_res
+
+
+def process_full_image(path, args, engine_config, source=None):
+    source = source or SourceImage(path)
+    if args.max_upload_dimension or args.upload_quality:
+        if needs_image(args):
+            source.image  # Decoded once at full size for the upload and the output
+        fp, scale = downscale_image(
+            path, args.max_upload_dimension, args.upload_quality or 95, source
+        )
+    else:
+        with timed("read"):
+            fp, scale = io.BytesIO(Path(path).read_bytes()), 1
+            fp.name = Path(path).name
+    with fp:
         api_res = recognition_api(
             fp,
             args.regions,
@@ -494,16 +1768,56 @@ def process_full_image(path, args, engine_config):
             camera_id=args.camera_id,
             mmc=args.mmc,
         )
+    if scale != 1:
+        scale_boxes(api_res, scale)
 
-    output_image(args, path, api_res)
+    if needs_image(args):
+        with timed("output_image"):
+            output_image(args, path, api_res, source)
     return api_res
 
 
+def imap_bounded(func, iterable, workers=1):
+    """
+    Apply func to every item of iterable using a pool of threads.
+
+    Results are yielded in input order. The iterable is consumed lazily and at
+    most 2 * workers calls are queued at any time.
+
+    :param func: callable taking a single item
+    :param iterable: items to process
+    :param workers: number of threads, 1 processes the items in the caller thread
+    """
+    if workers <= 1:
+        yield from map(func, iterable)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for item in iterable:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def process_path(path, args, engine_config):
+    with SourceImage(path) as source:
+        if args.split_image:
+            return process_split_image(path, args, engine_config, source)
+        return process_full_image(path, args, engine_config, source)
+
+
 def main():
     args = parse_arguments(custom_args)
-    paths = args.files
+    if args.output_file and not args.output_file.parent.exists():
+        print("%s does not exist" % args.output_file)
+        return
 
-    results = []
     engine_config = {}
     if args.engine_config:
         try:
@@ -511,18 +1825,73 @@ def main():
         except json.JSONDecodeError as e:
             print(e)
             return
-    for path in paths:
-        if not path.exists():
-            continue
-        if Path(path).is_file():
-            if args.split_image:
-                results.append(process_split_image(path, args, engine_config))
-            else:
-                results.append(process_full_image(path, args, engine_config))
-    if args.output_file:
-        save_results(results, args)
-    else:
-        print(json.dumps(results, indent=2))
+    manifest = None
+    append = False
+    if args.manifest:
+        manifest = Manifest(args.manifest)
+        if args.output_file and args.output_file.exists() and manifest.count():
+            # Resume: drop anything written after the last committed result
+            offset = manifest.output_offset()
+            if offset is not None:
+                WRITERS[args.format].truncate(args.output_file, offset)
+            append = offset is not None or args.format == "csv"
+    paths = (
+        path
+        for path in iter_files(args)
+        if path.exists()
+        and path.is_file()
+        and not (manifest and manifest.is_done(path))
+    )
+    if args.metrics or args.metrics_port:
+        enable_metrics()
+    if args.metrics_port:
+        get_metrics().serve(args.metrics_port)
+    cache = None
+    if args.cache_dir:
+        cache = ResultCache(args.cache_dir, max_size=args.cache_size * 1024**2)
+    duplicates = None
+    if args.dedup_threshold is not None:
+        from duplicates import DuplicateFilter
+
+        duplicates = DuplicateFilter(args.dedup_threshold, args.dedup_window)
+    client = RecognitionClient(
+        pool_size=args.pool_size or max(args.workers * args.tile_workers, 1),
+        cache=cache,
+        rate_limiter=RateLimiter(args.max_calls_per_second),
+        hedge_percentile=args.hedge_percentile,
+        json_decoder=args.json_decoder,
+        duplicates=duplicates,
+    )
+    set_client(client)
+    results = imap_bounded(
+        lambda path: (path, process_path(path, args, engine_config)),
+        paths,
+        args.workers,
+    )
+    with open_writer(args.output_file, args.format, append) as writer:
+        if manifest:
+            writer.on_flush = manifest.commit
+        for path, result in results:
+            with timed("write"):
+                writer.write(result)
+            if manifest:
+                manifest.add(path, writer.position)
+    if manifest:
+        manifest.close()
+    if args.metrics:
+        print(get_metrics().summary(), file=sys.stderr)
+    if args.sdk_url and len(args.sdk_url) > 1:
+        print(client.get_pool(args.sdk_url).summary(), file=sys.stderr)
+    if args.hedge_percentile:
+        print(
+            f"Hedged calls: {client.hedges}, won by the hedge: {client.hedge_wins}",
+            file=sys.stderr,
+        )
+    if duplicates:
+        print(duplicates.summary(), file=sys.stderr)
+    if cache:
+        print(f"Cache hits: {cache.hits}, misses: {cache.misses}", file=sys.stderr)
+        cache.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,799 @@
+import argparse
+import asyncio
+import copy
+import csv
+import email.utils
+import io
+import json
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+import pytest
+import requests
+from PIL import Image
+
+from plate_recognition import (
+    JSON_DECODERS,
+    EndpointPool,
+    JsonWriter,
+    RateLimiter,
+    RecognitionClient,
+    ResultCache,
+    SourceImage,
+    downscale_image,
+    imap_bounded,
+    iter_files,
+    main,
+    open_writer,
+    output_image,
+    parse_retry_after,
+    process_split_image,
+    recognize_files_async,
+    scale_boxes,
+    scan_dir,
+)
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_imap_bounded_keeps_input_order(workers):
+    def slow_square(x):
+        time.sleep((10 - x) * 0.001)
+        return x * x
+
+    assert list(imap_bounded(slow_square, range(10), workers)) == [
+        x * x for x in range(10)
+    ]
+
+
+def test_imap_bounded_limits_in_flight_calls():
+    lock = threading.Lock()
+    consumed = []
+    active = []
+    peak = []
+
+    def items():
+        for i in range(20):
+            consumed.append(i)
+            yield i
+
+    def work(x):
+        with lock:
+            active.append(x)
+            peak.append(len(active))
+        time.sleep(0.005)
+        with lock:
+            active.remove(x)
+        return x
+
+    results = imap_bounded(work, items(), workers=3)
+    assert next(results) == 0
+    assert len(consumed) <= 6
+    assert list(results) == list(range(1, 20))
+    assert max(peak) <= 3
+
+
+def mock_response(
+    status_code=200, text='{"results": [], "camera_id": null}', headers=None
+):
+    return mock.Mock(
+        status_code=status_code,
+        text=text,
+        content=text.encode(),
+        headers=headers or {},
+    )
+
+
+@mock.patch.object(requests.Session, "post")
+def test_recognition_client_endpoints(mock_post):
+    mock_post.return_value = mock_response()
+    client = RecognitionClient(pool_size=2)
+    fp = io.BytesIO(b"image")
+
+    client.recognize(fp, ["us-ca"], api_key="KEY")
+    url = mock_post.call_args.args[0]
+    assert url == "https://api.platerecognizer.com/v1/plate-reader/"
+    assert mock_post.call_args.kwargs["headers"] == {"Authorization": "Token KEY"}
+
+    client.recognize(fp, sdk_url="http://localhost:8080", camera_id="cam1")
+    url = mock_post.call_args.args[0]
+    assert url == "http://localhost:8080/v1/plate-reader/"
+    assert mock_post.call_args.kwargs["data"]["camera_id"] == "cam1"
+    assert mock_post.call_args.kwargs["headers"] == {}
+
+    client.recognize(fp, api_key="KEY", sdk_url="https://container-api.parkpow.com")
+    assert "image" in mock_post.call_args.kwargs["files"]
+
+
+@mock.patch("plate_recognition.time.sleep")
+@mock.patch.object(requests.Session, "post")
+def test_recognition_client_retries_throttled_calls(mock_post, mock_sleep):
+    mock_post.side_effect = [mock_response(429), mock_response()]
+    result = RecognitionClient().recognize(io.BytesIO(b"image"), api_key="KEY")
+    assert result == {"results": [], "camera_id": None}
+    assert mock_post.call_count == 2
+    mock_sleep.assert_called_once()
+
+
+@mock.patch("plate_recognition.time.sleep")
+@mock.patch.object(requests.Session, "post")
+def test_recognition_client_honors_retry_after(mock_post, mock_sleep):
+    mock_post.side_effect = [
+        mock_response(429, headers={"Retry-After": "3"}),
+        mock_response(),
+    ]
+    limiter = RateLimiter(max_rate=8)
+    client = RecognitionClient(rate_limiter=limiter)
+    client.recognize(io.BytesIO(b"image"), api_key="KEY")
+    assert mock_sleep.call_args.args[0] == pytest.approx(3, abs=0.1)
+    assert limiter.throttled_calls == 1
+    assert limiter.rate == 4 + 8 / 100
+
+
+def test_rate_limiter_paces_calls():
+    clock = [100.0]
+
+    def sleep(seconds):
+        clock[0] += seconds
+
+    with mock.patch("time.monotonic", lambda: clock[0]), mock.patch(
+        "time.sleep", sleep
+    ):
+        limiter = RateLimiter(max_rate=50)
+        for _ in range(11):
+            limiter.acquire()
+    assert clock[0] - 100 == pytest.approx(0.2)
+
+
+def test_rate_limiter_adjusts_rate():
+    limiter = RateLimiter(max_rate=10, min_rate=1)
+    for _ in range(5):
+        limiter.throttled()
+    assert limiter.rate == 1
+    for _ in range(200):
+        limiter.success()
+    assert limiter.rate == 10
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2") == 2
+    assert parse_retry_after("") == 1
+    assert parse_retry_after("soon") == 1
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert parse_retry_after(date) == pytest.approx(30, abs=2)
+
+
+def test_recognition_client_shares_pool_between_threads():
+    client = RecognitionClient(pool_size=4)
+    sessions = []
+    threads = [
+        threading.Thread(target=lambda: sessions.append(client.session))
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sessions[0] is not sessions[1]
+    assert sessions[0].get_adapter("http://x") is sessions[1].get_adapter("http://x")
+
+
+def test_recognize_files_async(tmp_path):
+    web = pytest.importorskip("aiohttp.web")
+    received = []
+    active = [0]
+    in_flight = []
+    consumed = []
+
+    async def plate_reader(request):
+        form = await request.post()
+        received.append(form["camera_id"])
+        active[0] += 1
+        in_flight.append(active[0])
+        consumed.append(len(read))
+        await asyncio.sleep(0.01)
+        active[0] -= 1
+        upload = form["upload"]
+        return web.json_response(
+            {"filename": upload.filename, "image": upload.file.read().decode()}
+        )
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/v1/plate-reader/", plate_reader)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            return await recognize_files_async(
+                iter_paths(),
+                concurrency=3,
+                sdk_url=f"http://127.0.0.1:{port}",
+                camera_id="cam1",
+            )
+        finally:
+            await runner.cleanup()
+
+    read = []
+
+    def iter_paths():
+        for i in range(20):
+            path = tmp_path / f"{i}.jpg"
+            path.write_text(str(i))
+            read.append(path)
+            yield path
+
+    results = asyncio.run(run())
+    assert [result["image"] for result in results] == [str(i) for i in range(20)]
+    assert [result["filename"] for result in results] == [f"{i}.jpg" for i in range(20)]
+    assert received == ["cam1"] * 20
+    assert max(in_flight) <= 3
+    # Paths are consumed as the uploads progress, not all up front
+    assert consumed[0] < 10
+
+
+@mock.patch.object(requests.Session, "post")
+def test_recognition_client_cache(mock_post, tmp_path):
+    mock_post.return_value = mock_response(
+        text='{"filename": "1617_a.jpg", "timestamp": "2024-01-01T16:17:10.386Z", '
+        '"camera_id": null, "processing_time": 80.5, "results": [], "plate": "abc"}'
+    )
+    cache = ResultCache(tmp_path)
+    client = RecognitionClient(cache=cache)
+
+    first = client.recognize(io.BytesIO(b"image"), ["us"], sdk_url="http://sdk")
+    copy = io.BytesIO(b"image")
+    copy.name = "/data/b.jpg"
+    second = client.recognize(copy, ["us"], sdk_url="http://sdk", timestamp="T")
+    assert first["results"] == second["results"]
+    assert second["filename"] == "b.jpg"
+    assert second["timestamp"] == "T"
+    assert second["processing_time"] == 0.0
+    assert mock_post.call_count == 1
+    client.recognize(io.BytesIO(b"image"), ["fr"], sdk_url="http://sdk")
+    client.recognize(io.BytesIO(b"other"), ["us"], sdk_url="http://sdk")
+    assert mock_post.call_count == 3
+    assert (cache.hits, cache.misses) == (1, 3)
+    cache.close()
+
+    # Entries are persisted
+    cache = ResultCache(tmp_path)
+    assert cache.get(ResultCache.make_key(b"image", ["us"])) is not None
+
+
+def test_result_cache_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(tmp_path, max_size=20)
+    cache.set("a", "x" * 8)
+    cache.set("b", "x" * 8)
+    cache.get("a")
+    cache.set("c", "x" * 8)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_result_cache_batches_access_times(tmp_path):
+    cache = ResultCache(tmp_path, touch_batch=3)
+    cache.set("a", "x")
+    with mock.patch.object(cache, "_db", wraps=cache._db) as db:
+        for _ in range(5):
+            cache.get("a")
+        assert db.commit.call_count == 1
+    cache.close()
+
+
+def test_result_cache_shared_with_another_process(tmp_path):
+    cache = ResultCache(tmp_path, max_size=20)
+    cache.set("a", "x" * 8)
+    cache.set("b", "x" * 8)
+    other = sqlite3.connect(str(tmp_path / "results.sqlite3"))
+    other.execute("DELETE FROM results")
+    other.commit()
+    other.close()
+    cache.set("c", "x" * 30)  # Larger than the cache, evicts everything
+    cache.set("d", "x" * 8)
+    assert cache.get("d") is not None
+    cache.close()
+
+
+RESULTS = [
+    {
+        "filename": f"car{i}.jpg",
+        "results": [
+            {"box": {"xmin": i, "ymin": 2, "xmax": 3, "ymax": 4}, "plate": "abc"},
+            {"box": {"xmin": 5, "ymin": 6, "xmax": 7, "ymax": 8}, "plate": "xyz"},
+        ],
+        "usage": {"calls": i},
+    }
+    for i in range(25)
+]
+
+
+def test_json_writer_matches_json_dump(tmp_path):
+    path = tmp_path / "out.json"
+    with JsonWriter(path, batch_size=7) as writer:
+        for result in RESULTS:
+            writer.write(result)
+    assert path.read_text() == json.dumps(RESULTS)
+
+
+@pytest.mark.parametrize("count", [0, 1, 3])
+def test_json_writer_stdout_matches_print(capsys, count):
+    with open_writer() as writer:
+        for result in RESULTS[:count]:
+            writer.write(result)
+    assert capsys.readouterr().out == json.dumps(RESULTS[:count], indent=2) + "\n"
+
+
+def test_jsonl_writer(tmp_path):
+    path = tmp_path / "out.jsonl"
+    with open_writer(path, "jsonl") as writer:
+        for result in RESULTS:
+            writer.write(result)
+    lines = path.read_text().splitlines()
+    assert [json.loads(line) for line in lines] == RESULTS
+
+
+def test_csv_writer(tmp_path):
+    path = tmp_path / "out.csv"
+    with open_writer(path, "csv") as writer:
+        for result in copy.deepcopy(RESULTS):
+            writer.write(result)
+    lines = path.read_text().splitlines()
+    assert lines[0] == "filename,box_xmin,box_ymin,box_xmax,box_ymax,plate"
+    assert lines[1:3] == ["car0.jpg,0,2,3,4,abc", "car0.jpg,5,6,7,8,xyz"]
+    assert len(lines) == 1 + 2 * len(RESULTS)
+
+
+@pytest.mark.parametrize("decoder", ["dict", "orjson"])
+@pytest.mark.parametrize("output_format", ["json", "csv"])
+def test_json_decoders_keep_output_order(tmp_path, decoder, output_format):
+    if decoder == "orjson":
+        pytest.importorskip("orjson")
+    text = json.dumps(RESULTS[:3]).encode()
+    for name in ["ordered", decoder]:
+        with open_writer(tmp_path / name, output_format) as writer:
+            for result in JSON_DECODERS[name](text):
+                writer.write(result)
+    assert (tmp_path / decoder).read_text() == (tmp_path / "ordered").read_text()
+
+
+def test_csv_writer_writes_every_batch(tmp_path):
+    path = tmp_path / "out.csv"
+    writer = open_writer(path, "csv")
+    writer.batch_size = 2
+    flushed = []
+    writer.on_flush = lambda: flushed.append(writer.position)
+    for result in copy.deepcopy(RESULTS[:5]):
+        writer.write(result)
+    # Rows of full batches reach the file before the writer is closed
+    assert flushed == [4, 8]
+    with open(path) as fp:
+        assert len(list(csv.DictReader(fp))) == 8
+    writer.close()
+    with open(path) as fp:
+        assert len(list(csv.DictReader(fp))) == 10
+
+
+def test_writer_without_results_creates_no_file(tmp_path):
+    path = tmp_path / "out.csv"
+    with open_writer(path, "csv"):
+        pass
+    assert not path.exists()
+
+
+def test_csv_writer_collects_columns_of_all_results(tmp_path):
+    path = tmp_path / "out.csv"
+    results = copy.deepcopy(RESULTS)
+    results[15]["results"][1]["direction"] = 90
+    results[20]["results"][0]["model_make"] = [{"make": "bmw", "score": 0.8}]
+    with open_writer(path, "csv") as writer:
+        for result in results:
+            writer.write(result)
+    with open(path) as fp:
+        rows = list(csv.DictReader(fp))
+    assert list(rows[0]) == [
+        "filename",
+        "box_xmin",
+        "box_ymin",
+        "box_xmax",
+        "box_ymax",
+        "plate",
+        "model_make",
+        "direction",
+    ]
+    assert rows[31]["direction"] == "90"
+    assert json.loads(rows[40]["model_make"]) == [{"make": "bmw", "score": 0.8}]
+    assert rows[0]["direction"] == rows[0]["model_make"] == ""
+    assert len(rows) == 2 * len(results)
+
+
+def fake_recognition_api(fp, *args, **kwargs):
+    """Detect a plate in the middle of every tile, scored by the tile size."""
+    width, height = Image.open(fp).size
+    time.sleep(0.001 * (width % 7))
+    box = dict(
+        xmin=width // 2 - 20,
+        ymin=height // 2 - 10,
+        xmax=width // 2 + 20,
+        ymax=height // 2 + 10,
+    )
+    return dict(
+        camera_id=None,
+        timestamp="2024-01-01T00:00:00Z",
+        processing_time=1.0,
+        results=[
+            dict(
+                box=box,
+                plate="abc",
+                score=width / 10000,
+                vehicle=dict(score=0, box=dict(box)),
+            )
+        ],
+    )
+
+
+@mock.patch("plate_recognition.recognition_api", fake_recognition_api)
+def test_process_split_image_tile_workers(tmp_path):
+    path = tmp_path / "car.jpg"
+    Image.new("RGB", (1600, 1200)).save(path)
+    args = argparse.Namespace(
+        split_x=3,
+        split_y=2,
+        split_overlap=10,
+        regions=None,
+        api_key=None,
+        sdk_url="http://sdk",
+        camera_id=None,
+        mmc=False,
+        show_boxes=False,
+        annotate_images=False,
+        crop_lp=None,
+        crop_vehicle=None,
+        tile_workers=1,
+        max_upload_dimension=None,
+        upload_quality=None,
+    )
+    expected = process_split_image(path, args, {})
+    args.tile_workers = 4
+    assert process_split_image(path, args, {}) == expected
+    assert len(expected["results"]) > 1
+
+
+def tile_centers(path, args, recognize):
+    """Centers of the plate boxes of every tile, in image coordinates."""
+    import bounding_boxes
+
+    centers = []
+
+    def merge_results(results):
+        for tile in results:
+            for result in tile["prediction"]["results"]:
+                b = result["box"]
+                x = tile["x"] + (b["xmin"] + b["xmax"]) / 2
+                y = tile["y"] + (b["ymin"] + b["ymax"]) / 2
+                centers.append((x, y))
+        return merge(results)
+
+    merge = bounding_boxes.merge_results
+    with mock.patch("plate_recognition.recognition_api", recognize), mock.patch(
+        "bounding_boxes.merge_results", merge_results
+    ):
+        process_split_image(path, args, {})
+    return centers
+
+
+def test_process_split_image_downscales_tiles(tmp_path):
+    path = tmp_path / "car.jpg"
+    Image.new("RGB", (1600, 1200)).save(path)
+    args = argparse.Namespace(
+        split_x=2,
+        split_y=1,
+        split_overlap=10,
+        regions=None,
+        api_key=None,
+        sdk_url="http://sdk",
+        camera_id=None,
+        mmc=False,
+        show_boxes=False,
+        annotate_images=False,
+        crop_lp=None,
+        crop_vehicle=None,
+        tile_workers=1,
+        max_upload_dimension=None,
+        upload_quality=None,
+    )
+    expected = tile_centers(path, args, fake_recognition_api)
+    uploaded = []
+
+    def recognize_small(fp, *args, **kwargs):
+        uploaded.append(Image.open(fp).size)
+        fp.seek(0)
+        return fake_recognition_api(fp)
+
+    args.max_upload_dimension = 300
+    args.upload_quality = 80
+    centers = tile_centers(path, args, recognize_small)
+    assert max(max(size) for size in uploaded) == 300
+    # Boxes found in the downscaled tiles are mapped back to the full image
+    assert len(centers) == len(expected) == 7
+    flat = [value for center in centers for value in center]
+    assert flat == pytest.approx(
+        [value for center in expected for value in center], abs=4
+    )
+
+
+def test_downscale_image_and_scale_boxes(tmp_path):
+    path = tmp_path / "car.png"
+    Image.new("RGBA", (4000, 3000)).save(path)
+    fp, scale = downscale_image(path, max_dimension=1000, quality=80)
+    assert Image.open(fp).size == (1000, 750)
+    assert scale == 4
+
+    api_res = dict(
+        results=[
+            dict(
+                box=dict(xmin=10, ymin=20, xmax=30, ymax=40),
+                vehicle=dict(box=dict(xmin=0, ymin=1, xmax=100, ymax=101)),
+            ),
+            dict(box=dict(xmin=1, ymin=2, xmax=3, ymax=4), vehicle=dict(box={})),
+        ]
+    )
+    scale_boxes(api_res, scale)
+    assert api_res["results"][0]["box"] == dict(xmin=40, ymin=80, xmax=120, ymax=160)
+    assert api_res["results"][0]["vehicle"]["box"]["xmax"] == 400
+    assert api_res["results"][1]["box"] == dict(xmin=4, ymin=8, xmax=12, ymax=16)
+
+
+@pytest.mark.parametrize("output_format", ["json", "jsonl", "csv"])
+def test_main_resumes_from_manifest(tmp_path, monkeypatch, output_format):
+    paths = []
+    for i in range(6):
+        path = tmp_path / f"car{i}.jpg"
+        path.write_bytes(b"image")
+        paths.append(str(path))
+    output = tmp_path / f"out.{output_format}"
+    manifest = tmp_path / "manifest.sqlite3"
+    processed = []
+
+    def fake_process_path(path, args, engine_config):
+        processed.append(path.name)
+        result = dict(filename=path.name, results=[dict(plate="abc")])
+        if path.name == "car4.jpg":
+            result["results"][0]["direction"] = 90
+        return result
+
+    def run(files):
+        argv = ["plate_recognition.py", "-s", "http://sdk", "--manifest"]
+        argv += [str(manifest), "-o", str(output), "--format", output_format]
+        monkeypatch.setattr(sys, "argv", argv + files)
+        main()
+
+    monkeypatch.setattr("plate_recognition.process_path", fake_process_path)
+    run(paths[:3])
+    with open(output, "a") as fp:
+        # Partial write of a crashed run
+        fp.write(', {"filename": "interrupted' if output_format != "csv" else "car9")
+    run(paths)
+    assert processed == [f"car{i}.jpg" for i in [0, 1, 2, 3, 4, 5]]
+    run(paths)  # Nothing left to do, the output must stay complete
+    assert len(processed) == 6
+
+    if output_format == "json":
+        filenames = [result["filename"] for result in json.loads(output.read_text())]
+    elif output_format == "jsonl":
+        lines = output.read_text().splitlines()
+        filenames = [json.loads(line)["filename"] for line in lines]
+    else:
+        with open(output) as fp:
+            rows = list(csv.DictReader(fp))
+        filenames = [row["filename"] for row in rows]
+        assert list(rows[0]) == ["filename", "plate", "direction"]
+        assert rows[4]["direction"] == "90"
+    assert filenames == [f"car{i}.jpg" for i in range(6)]
+
+
+def test_iter_files(tmp_path):
+    for name in ["a.jpg", "b.png", "sub/c.jpg", "sub/deep/d.jpg", "skip/e.jpg"]:
+        path = tmp_path / "images" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"")
+    listed = tmp_path / "list.txt"
+    listed.write_text("/data/x.jpg\n\n/data/y.jpg\n")
+    args = argparse.Namespace(
+        files=[Path("z.jpg")],
+        from_list=listed,
+        input_dir=[tmp_path / "images"],
+        include=["*.jpg"],
+        exclude=["skip"],
+    )
+    files = iter_files(args)
+    assert next(files) == Path("z.jpg")
+    files = list(files)
+    assert files[:2] == [Path("/data/x.jpg"), Path("/data/y.jpg")]
+    relative = sorted(str(path.relative_to(tmp_path / "images")) for path in files[2:])
+    assert relative == ["a.jpg", "sub/c.jpg", "sub/deep/d.jpg"]
+
+
+def test_scan_dir_does_not_follow_symlink_cycles(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "a.jpg").write_bytes(b"")
+    (tmp_path / "sub" / "loop").symlink_to(tmp_path)
+    (tmp_path / "b.jpg").symlink_to(tmp_path / "sub" / "a.jpg")
+    (tmp_path / "broken.jpg").symlink_to(tmp_path / "missing.jpg")
+    found = sorted(path.relative_to(tmp_path) for path in scan_dir(tmp_path))
+    assert found == [Path("b.jpg"), Path("sub/a.jpg")]
+
+
+def test_iter_files_leaves_stdin_open(monkeypatch):
+    stdin = io.StringIO("/data/x.jpg\n")
+    monkeypatch.setattr(sys, "stdin", stdin)
+    args = argparse.Namespace(files=[], from_list="-", input_dir=None)
+    assert list(iter_files(args)) == [Path("/data/x.jpg")]
+    assert not stdin.closed
+
+
+def test_source_image_decodes_once(tmp_path):
+    path = tmp_path / "car.jpg"
+    Image.new("RGB", (4000, 3000)).save(path)
+    source = SourceImage(path)
+    assert source.size == (4000, 3000)
+    assert source.thumbnail(500).size == (500, 375)
+    assert not source.decoded
+    assert source.image is source.image
+    with mock.patch("PIL.Image.open") as mock_open:
+        assert source.thumbnail(500).size == (500, 375)
+    mock_open.assert_not_called()
+
+
+def test_source_image_close(tmp_path):
+    path = tmp_path / "car.jpg"
+    Image.new("RGB", (400, 300)).save(path)
+    with SourceImage(path) as source:
+        assert source.size == (400, 300)
+        header = source._file
+    assert header.fp is None  # File released without decoding the pixels
+    assert source.size == (400, 300)
+
+
+def test_output_image_crops_are_not_annotated(tmp_path):
+    path = tmp_path / "car.png"
+    Image.new("RGB", (200, 100)).save(path)
+    results = dict(
+        results=[
+            dict(
+                box=dict(xmin=10, ymin=40, xmax=60, ymax=60),
+                plate="abc",
+                region=dict(code="us"),
+                vehicle=dict(score=0),
+            )
+        ]
+    )
+    args = argparse.Namespace(
+        show_boxes=False,
+        annotate_images=True,
+        crop_lp=tmp_path / "crops",
+        crop_vehicle=None,
+    )
+    output_image(args, path, results)
+    annotated = Image.open(tmp_path / "car_annotated.png")
+    assert annotated.getpixel((10, 50)) == (0, 255, 0)
+    cropped = Image.open(tmp_path / "crops" / "abc_us_car.png")
+    assert cropped.size == (50, 20)
+    assert cropped.getextrema() == ((0, 0), (0, 0), (0, 0))
+
+
+def test_import_does_not_load_heavy_dependencies():
+    code = (
+        "import sys, plate_recognition; "
+        "print([m for m in ('PIL', 'requests', 'numpy', 'csv') if m in sys.modules])"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=Path(__file__).parent,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    assert output.strip() == "[]"
+
+
+def test_endpoint_pool_picks_least_outstanding():
+    pool = EndpointPool(["http://a", "http://b", "http://c"])
+    first = pool.acquire()
+    second = pool.acquire()
+    third = pool.acquire()
+    assert {first.url, second.url, third.url} == {"http://a", "http://b", "http://c"}
+    pool.release(second, True)
+    assert pool.acquire() is second
+
+
+def test_endpoint_pool_ejects_and_probes(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("plate_recognition.time.monotonic", lambda: now[0])
+    pool = EndpointPool(["http://a", "http://b"], max_failures=2, cooldown=10)
+    a, b = pool.endpoints
+    for _ in range(2):
+        assert {pool.acquire(), pool.acquire()} == {a, b}
+        pool.release(a, False)
+        pool.release(b, True)
+    assert a.ejections == 1
+    assert all(pool.acquire() is b for _ in range(5))
+
+    now[0] += 11
+    assert pool.acquire() is a  # Single probe
+    assert pool.acquire() is b
+    pool.release(a, True)
+    assert a.failures == 0 and a.ejected_until == 0
+    assert "| http://a" in pool.summary()
+
+
+@mock.patch.object(requests.Session, "post")
+def test_recognition_client_fails_over(mock_post):
+    def post(url, **kwargs):
+        if url.startswith("http://down"):
+            raise requests.ConnectionError()
+        return mock_response()
+
+    mock_post.side_effect = post
+    client = RecognitionClient()
+    sdk_url = ["http://down:8080", "http://up:8080"]
+    for _ in range(4):
+        assert client.recognize(io.BytesIO(b"image"), sdk_url=sdk_url) == {
+            "results": [],
+            "camera_id": None,
+        }
+    down, up = client.get_pool(sdk_url).endpoints
+    assert up.requests == 4
+    assert down.errors == down.requests == 3
+    assert down.ejections == 1
+
+    with pytest.raises(requests.ConnectionError):
+        client.recognize(io.BytesIO(b"image"), sdk_url="http://down:8080")
+
+
+@mock.patch.object(requests.Session, "post")
+def test_recognition_client_hedges_slow_calls(mock_post):
+    released = threading.Event()
+
+    def post(url, files, **kwargs):
+        assert files["upload"] == ("image.jpg", b"image")
+        if url.startswith("http://slow"):
+            # Only answers once the hedge is done
+            released.wait(5)
+            return mock_response(text='{"results": [], "camera_id": "slow"}')
+        if url.startswith("http://broken"):
+            return mock_response(503, text="unavailable")
+        return mock_response(text='{"results": [], "camera_id": "fast"}')
+
+    mock_post.side_effect = post
+    limiter = RateLimiter()
+    client = RecognitionClient(hedge_percentile=90, rate_limiter=limiter)
+    assert client.hedge_delay() is None
+    client._latencies.extend([0.01] * 20)
+
+    with mock.patch.object(limiter, "acquire", wraps=limiter.acquire) as acquire:
+        sdk_url = ["http://slow:8080", "http://fast:8080"]
+        result = client.recognize(io.BytesIO(b"image"), sdk_url=sdk_url)
+        released.set()
+        assert result["camera_id"] == "fast"
+        assert client.hedges == 1
+        assert client.hedge_wins == 1
+        # The hedge is rate limited like the first call
+        assert acquire.call_count == 2
+
+        # A quick 503 from the hedge does not beat a slow success
+        released.clear()
+        threading.Timer(0.05, released.set).start()
+        sdk_url = ["http://slow:8081", "http://broken:8080"]
+        result = client.recognize(io.BytesIO(b"image"), sdk_url=sdk_url)
+        assert result["camera_id"] == "slow"
+        assert client.hedges == 2
+        assert client.hedge_wins == 1
+    client.close()
@@ -1,4 +1,5 @@
 import argparse
+import copy
 import json
 import os
 import queue
@@ -37,7 +38,11 @@ except ImportError:
     )
     exit(1)
 
+from duplicates import DuplicateFilter, dhash
+from metrics import enable_metrics, timed
+
 _queue = queue.Queue(256)  # type: ignore
+_duplicates = None
 
 ##########################
 # Command line arguments #
@@ -111,6 +116,24 @@ If it the --api-url is not defined, the results will be saved in the output file
     parser.add_argument(
         "--output-file", help="Json file with response", type=str, required=False
     )
+    parser.add_argument(
+        "--metrics-port",
+        help="Expose the duration of each processing stage on http://0.0.0.0:PORT/metrics (Prometheus format).",
+        type=int,
+        required=False,
+    )
+    parser.add_argument(
+        "--dedup-threshold",
+        help="Reuse the results of a recent image of the same camera when the perceptual hashes differ by at most this many bits (out of 64), for example 4. Requires Pillow.",
+        type=int,
+        required=False,
+    )
+    parser.add_argument(
+        "--dedup-window",
+        help="Number of recent images per camera compared with --dedup-threshold.",
+        type=int,
+        default=20,
+    )
 
     return parser.parse_args()
 
@@ -129,7 +152,7 @@ def image_transfer(src_path, args):
 
     filename = split[-1]
     camera = split[-args.cam_pos - 1]
-    results = alpr(src_path, args)
+    results = alpr(src_path, args, camera)
     if not results:
         return
 
@@ -145,7 +168,7 @@ def image_transfer(src_path, args):
             return
     else:
 
-        with jsonlines.open(args.output_file, mode="a") as json_file:
+        with timed("write"), jsonlines.open(args.output_file, mode="a") as json_file:
             json_file.write(results)
             response = results
 
@@ -163,25 +186,37 @@ def image_transfer(src_path, args):
     return dict(dest=destination, response=response)
 
 
-def alpr(path, args):
+def alpr(path, args, camera=None):
+    time.sleep(1)  # Wait for the whole image to arrive
+    image_hash = None
+    if _duplicates:
+        try:
+            with timed("hash"):
+                image_hash = dhash(path)
+        except Exception as e:
+            print(e)
+        else:
+            results = _duplicates.get(camera, image_hash)
+            if results is not None:
+                print(f"Reusing the results of a similar image for {path}")
+                return copy.deepcopy(results)
     print("Sending %s" % path)
     try:
         if "localhost" in args.alpr_api:
-            time.sleep(1)  # Wait for the whole image to arrive
-            with open(path, "rb") as fp:
+            with open(path, "rb") as fp, timed("network", args.alpr_api):
                 response = requests.post(
                     args.alpr_api, files=dict(upload=fp), timeout=10
                 )
         else:
-            time.sleep(1)  # Wait for the whole image to arrive
             filename = os.path.basename(path)
-            response = requests.post(
-                args.alpr_api,
-                files=dict(
-                    upload=(filename, open(path, "rb"), "application/octet-stream")
-                ),
-                headers={"Authorization": "Token " + args.platerec_token},
-            )
+            with timed("network", args.alpr_api):
+                response = requests.post(
+                    args.alpr_api,
+                    files=dict(
+                        upload=(filename, open(path, "rb"), "application/octet-stream")
+                    ),
+                    headers={"Authorization": "Token " + args.platerec_token},
+                )
 
     except requests.exceptions.Timeout:
         print("SDK: Timeout")
@@ -196,10 +231,11 @@ def alpr(path, args):
         print(e)
         return
     data = response.json()
-    # TODO: skip data if there is no change
     if "results" not in data:
         print(data)
         return []
+    if image_hash is not None:
+        _duplicates.add(camera, image_hash, copy.deepcopy(data["results"]))
     return data["results"]
 
 
@@ -207,9 +243,10 @@ def api_request(args, payload, files):
     api_url = "https://app.parkpow.com/api/v1/log-vehicle"
     headers = {"Authorization": f"Token {args.parkpow_token}"}
     try:
-        response = requests.post(
-            api_url, data=payload, headers=headers, files=files, timeout=20
-        )
+        with timed("network", api_url):
+            response = requests.post(
+                api_url, data=payload, headers=headers, files=files, timeout=20
+            )
     except ConnectionError:
         print("ParkPow API: ConnectionError")
         return
@@ -239,6 +276,7 @@ class Handler(PatternMatchingEventHandler):
 
 
 def main(args, debug=False):
+    global _duplicates
     if args.source in args.archive:
         print("Archive argument should not be in source directory.")
         return exit(1)
@@ -249,6 +287,10 @@ def main(args, debug=False):
         recursive=True,
     )
     observer.start()
+    if args.dedup_threshold is not None:
+        _duplicates = DuplicateFilter(args.dedup_threshold, args.dedup_window)
+    if args.metrics_port:
+        enable_metrics().serve(args.metrics_port)
     for _ in range(args.workers):
         t = threading.Thread(target=worker, args=(args,))
         t.daemon = True
@@ -266,6 +308,8 @@ def main(args, debug=False):
     observer.stop()
     observer.join()
     _queue.join()
+    if _duplicates:
+        print(_duplicates.summary())
 
 
 def validate_env(args):
@@ -1,3 +1,4 @@
+import email.utils
 import logging
 import os
 import sys
@@ -27,6 +28,23 @@ lgr = logging.getLogger("video-editor")
 BASE_WORKING_DIR = "/user-data/"
 
 
+def retry_after(response, default=1.0):
+    """Seconds to wait before retrying a call throttled with a 429."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # Retry-After may also be an HTTP date
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
 def recognition_api(cv2_frame, data, sdk_url, api_key):
     retval, buffer = cv2.imencode(".jpg", cv2_frame)
 
@@ -47,7 +65,7 @@ def recognition_api(cv2_frame, data, sdk_url, api_key):
 
         if response.status_code < 200 or response.status_code > 300:
             if response.status_code == 429:
-                time.sleep(1)
+                time.sleep(retry_after(response))
             else:
                 logging.error(response.text)
                 raise Exception("Error running recognition")